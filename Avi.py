@@ -1,14 +1,23 @@
-from ctypesutil import read_structure
+from structutil import define_record
+import BlockCache
+import FrameTypes
 import Timecode
 
-from ctypes import LittleEndianStructure, c_char, c_int32, c_uint16, c_uint32, sizeof
 import collections
+import concurrent.futures
+import functools
+import hashlib
+import heapq
+import io
 import math
 import os
 import pprint
 import re
+import shutil
 import struct
 import sys
+import tempfile
+import threading
 
 
 # http://www.alexander-noe.com/video/documentation/avi.pdf
@@ -21,9 +30,23 @@ _4CC_NULL = b"\x00" * 4
 
 _VFRAME_ID_PATTERN = re.compile(r"^(\d\d)(d[bc])$")
 _VFRAME_ID_FORMAT = "{0:02d}{1:2s}"
+_STREAM_CHUNK_PATTERN = re.compile(br"^\d\d..$", re.DOTALL)
 
 _METERS_PER_INCH = 0.0254
 
+_COPY_BLOCK_SIZE = 1 << 24
+
+# default limit on frame data read but not yet written when extracting
+_EXTRACT_IN_FLIGHT = 1 << 26
+
+# AviOutput moves its index to a temporary file once it grows past this size
+_INDEX_SPILL_SIZE = 1 << 24
+
+# reads of nearby ranges are merged if the gap between them is at most
+# _COALESCE_GAP bytes, up to a total of _COALESCE_SPAN bytes
+_COALESCE_GAP = 1 << 16
+_COALESCE_SPAN = 1 << 22
+
 
 F_HASINDEX =        0x00000010
 F_MUSTUSEINDEX =    0x00000020
@@ -32,75 +55,80 @@ F_TRUSTCKTYPE =     0x00000800
 F_WASCAPTUREFILE =  0x00010000
 F_COPYRIGHTED =     0x00020000
 
-class MainHeader(LittleEndianStructure):
-    _pack_ = 1
-    _fields_ = [
-        ("MicroSecPerFrame",    c_uint32),
-        ("MaxBytesPerSec",      c_uint32),
-        ("PaddingGranularity",  c_uint32),
-        ("Flags",               c_uint32),
-        ("TotalFrames",         c_uint32),
-        ("InitialFrames",       c_uint32),
-        ("Streams",             c_uint32),
-        ("SuggestedBufferSize", c_uint32),
-        ("Width",               c_uint32),
-        ("Height",              c_uint32),
-        ("Reserved",            c_char * 16)
-    ]
-
-
-class StreamHeader(LittleEndianStructure):
-    _pack_ = 1
-    _fields_ = [
-        ("fccType",             c_char * 4),
-        ("fccHandler",          c_char * 4),
-        ("Flags",               c_uint32),
-        ("Priority",            c_uint16),
-        ("Language",            c_uint16),
-        ("InitialFrames",       c_uint32),
-        ("Scale",               c_uint32),
-        ("Rate",                c_uint32),
-        ("Start",               c_uint32),
-        ("Length",              c_uint32),
-        ("SuggestedBufferSize", c_uint32),
-        ("Quality",             c_uint32),
-        ("SampleSize",          c_uint32),
-        ("left",                c_uint16),
-        ("top",                 c_uint16),
-        ("right",               c_uint16),
-        ("bottom",              c_uint16)
-    ]
+MainHeader = define_record("MainHeader", [
+    ("MicroSecPerFrame",    "I"),
+    ("MaxBytesPerSec",      "I"),
+    ("PaddingGranularity",  "I"),
+    ("Flags",               "I"),
+    ("TotalFrames",         "I"),
+    ("InitialFrames",       "I"),
+    ("Streams",             "I"),
+    ("SuggestedBufferSize", "I"),
+    ("Width",               "I"),
+    ("Height",              "I"),
+    ("Reserved",            "16s")
+])
+
+
+StreamHeader = define_record("StreamHeader", [
+    ("fccType",             "4s"),
+    ("fccHandler",          "4s"),
+    ("Flags",               "I"),
+    ("Priority",            "H"),
+    ("Language",            "H"),
+    ("InitialFrames",       "I"),
+    ("Scale",               "I"),
+    ("Rate",                "I"),
+    ("Start",               "I"),
+    ("Length",              "I"),
+    ("SuggestedBufferSize", "I"),
+    ("Quality",             "I"),
+    ("SampleSize",          "I"),
+    ("left",                "H"),
+    ("top",                 "H"),
+    ("right",               "H"),
+    ("bottom",              "H")
+])
 
 
 IF_LIST =     0x00000001
 IF_KEYFRAME = 0x00000010
 IF_NO_TIME =  0x00000100
 
-class OldIndexEntry(LittleEndianStructure):
-    _pack_ = 1
-    _fields_ = [
-        ("ChunkId", c_char * 4),
-        ("Flags",   c_uint32),
-        ("Offset",  c_uint32),
-        ("Size",    c_uint32)
-    ]
-
-
-class BitmapInfoHeader(LittleEndianStructure):
-    _pack_ = 1
-    _fields_ = [
-        ("Size",          c_uint32),
-        ("Width",         c_int32),
-        ("Height",        c_int32),
-        ("Planes",        c_uint16),
-        ("BitCount",      c_uint16),
-        ("Compression",   c_char * 4),
-        ("SizeImage",     c_uint32),
-        ("XPelsPerMeter", c_int32),
-        ("YPelsPerMeter", c_int32),
-        ("ClrUsed",       c_uint32),
-        ("ClrImportant",  c_uint32)
-    ]
+OldIndexEntry = define_record("OldIndexEntry", [
+    ("ChunkId", "4s"),
+    ("Flags",   "I"),
+    ("Offset",  "I"),
+    ("Size",    "I")
+])
+
+
+BitmapInfoHeader = define_record("BitmapInfoHeader", [
+    ("Size",          "I"),
+    ("Width",         "i"),
+    ("Height",        "i"),
+    ("Planes",        "H"),
+    ("BitCount",      "H"),
+    ("Compression",   "4s"),
+    ("SizeImage",     "I"),
+    ("XPelsPerMeter", "i"),
+    ("YPelsPerMeter", "i"),
+    ("ClrUsed",       "I"),
+    ("ClrImportant",  "I")
+])
+
+
+# how AviOutput writes a frame whose data repeats an earlier one
+REPEAT_COPY =      0  # write the data again
+REPEAT_EMPTY =     1  # write a zero-length chunk, which players treat as a
+                      # repeat of the previous frame
+REPEAT_REFERENCE = 2  # only add an index entry pointing at the earlier chunk
+
+# how many distinct chunks REPEAT_REFERENCE remembers per stream
+_REPEAT_CACHE_SIZE = 1 << 14
+
+_CHUNK_HEADER = struct.Struct("<4sI")
+_CHUNK_SIZE = struct.Struct("<I")
 
 
 _Chunk = collections.namedtuple("_Chunk",
@@ -123,6 +151,10 @@ class FormatError(Exception):
     pass
 
 
+class CompatibilityError(Exception):
+    pass
+
+
 def _expect_equal(noun, expect, got):
     if expect != got:
         raise FormatError("Expected {0} of type {1!r}, got {2!r}".format(
@@ -136,6 +168,35 @@ def _from_asciiz(byte_string):
     return byte_string.decode(_CP_WINDOWS)
 
 
+def check_compatible(basis_avi, other_avi):
+    """Raises CompatibilityError if the video streams of other_avi can't be
+    joined onto those of basis_avi without re-encoding."""
+    if len(basis_avi.video_streams) != len(other_avi.video_streams):
+        raise CompatibilityError("Expected {0} video streams, got {1}".format(
+            len(basis_avi.video_streams), len(other_avi.video_streams)))
+
+    for bvs, ovs in zip(basis_avi.video_streams, other_avi.video_streams):
+        _expect_compatible("stream number", bvs.stream_num, ovs.stream_num)
+        _expect_compatible("codec", bvs.codec, ovs.codec)
+        _expect_compatible("codec data", bvs.codec_data, ovs.codec_data)
+        _expect_compatible("frame rate",
+            Timecode.interpret_frame_rate(bvs.frame_rate),
+            Timecode.interpret_frame_rate(ovs.frame_rate))
+
+        bbi = basis_avi._stream_data[bvs.stream_num].bitmap_info
+        obi = other_avi._stream_data[ovs.stream_num].bitmap_info
+        for field in ("Width", "Height", "Planes", "BitCount", "Compression",
+                "ClrUsed"):
+            _expect_compatible(field, getattr(bbi, field), getattr(obi, field))
+
+
+def _expect_compatible(noun, expect, got):
+    if expect != got:
+        raise CompatibilityError("Expected {0} {1!r}, got {2!r}".format(
+            noun, expect, got))
+
+
+@functools.lru_cache(maxsize=None)
 def _unpack_frame_fcc(fcc):
     match = _VFRAME_ID_PATTERN.match(fcc.decode(_CP_WINDOWS))
     if match is None:
@@ -143,24 +204,92 @@ def _unpack_frame_fcc(fcc):
     return (int(match.group(1)), match.group(2))
 
 
+def _pack_frame_fcc(stream_num, frame_type):
+    if isinstance(frame_type, bytes):
+        frame_type = frame_type.decode(_CP_WINDOWS)
+    return _VFRAME_ID_FORMAT.format(stream_num, frame_type).encode(_CP_WINDOWS)
+
+
+def _interleave(tracks):
+    # merges index tracks so that entries at the same relative position in
+    # each track end up next to each other
+    return (p for _, p in heapq.merge(
+        *(((i / len(t), p) for i, p in enumerate(t)) for t in tracks if t),
+        key=lambda t: t[0]))
+
+
+def _coalesce_reads(requests, max_gap=_COALESCE_GAP, max_span=_COALESCE_SPAN):
+    # groups (pos, length, tag) requests into runs that can each be served
+    # by a single read. returns a list of (pos, length, requests)
+    runs = [ ]
+    run_pos = run_end = None
+    members = None
+    for request in sorted(requests, key=lambda r: r[0]):
+        pos, length, _ = request
+        end = pos + length
+        if (members is not None and pos - run_end <= max_gap and
+                max(end, run_end) - run_pos <= max_span):
+            members.append(request)
+            run_end = max(end, run_end)
+        else:
+            if members is not None:
+                runs.append((run_pos, run_end - run_pos, members))
+            run_pos, run_end, members = pos, end, [ request ]
+    if members is not None:
+        runs.append((run_pos, run_end - run_pos, members))
+    return runs
+
+
+def _bounded_map(executor, func, items, window):
+    # like executor.map, but only keeps window calls in flight at once
+    pending = collections.deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+class _ByteBudget(object):
+    # blocks acquirers while more than limit bytes are held. a single
+    # request larger than the limit is let through when nothing else is held
+    def __init__(self, limit):
+        self._limit = limit
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        with self._cond:
+            while self._used > 0 and self._used + size > self._limit:
+                self._cond.wait()
+            self._used += size
+
+    def release(self, size):
+        with self._cond:
+            self._used -= size
+            self._cond.notify_all()
+
+
 class _RateMonitor(object):
     def __init__(self, fps, min_sample_count=0):
         self._fps = float(fps)
-        self._num_samples = int(math.ceil(self._fps))
-        self._samples = list()
+        self._samples = collections.deque(maxlen=max(1, int(math.ceil(self._fps))))
+        self._total = 0
         self._max = 0.0
         self._min_sample_count = min_sample_count
 
     def sample(self, size):
-        if len(self._samples) == self._num_samples:
-            self._samples.pop(0)
+        if len(self._samples) == self._samples.maxlen:
+            self._total -= self._samples[0]
         self._samples.append(size)
+        self._total += size
         if len(self._samples) > self._min_sample_count:
             self._max = max(self._max, self.rate())
 
     def rate(self):
         if len(self._samples) > 0:
-            return sum(self._samples) * self._fps / len(self._samples)
+            return self._total * self._fps / len(self._samples)
         return 0.0
 
     def max(self):
@@ -206,8 +335,33 @@ class OutputVideoStream(VideoStream):
     def write_frame(self, avi_frame):
         self._owner.write_stream_frame(self.stream_num, avi_frame)
 
+    def write_frame_array(self, array, flags=IF_KEYFRAME):
+        """Writes a frame of an uncompressed stream from a NumPy array, laid
+        out as returned by InputVideoStream.get_frame_array."""
+        # numpy is only needed for raw frame access
+        import RawVideo
+        self._owner.write_stream_frame_parts(self.stream_num, b"db", flags,
+            RawVideo.frame_parts(self, array))
+
 
 class InputVideoStream(VideoStream):
+    def __init__(self, owner):
+        super(InputVideoStream, self).__init__(owner)
+        self._frame_types = None
+        # the frame count according to the stream header, or the file header
+        # if that's zero, which is known without loading the index. Files
+        # that weren't finalized properly may disagree with frame_count
+        self.declared_frame_count = 0
+
+    @property
+    def frame_count(self):
+        self._owner._require_index()
+        return self._frame_count
+
+    @frame_count.setter
+    def frame_count(self, value):
+        self._frame_count = value
+
     def get_frame(self, frame_num=None, seconds=None, timecode=None):
         if timecode is not None:
             frame_num = self.timecode_to_frame(timecode)
@@ -216,6 +370,57 @@ class InputVideoStream(VideoStream):
 
         return self._owner.get_stream_frame(self.stream_num, frame_num)
 
+    def get_frame_array(self, frame_num=None, seconds=None, timecode=None,
+            writable=False):
+        """Returns a frame of an uncompressed stream as a NumPy array viewing
+        the frame's data, with rows ordered top to bottom. See
+        RawVideo.frame_array for the layout. If writable is True, the data is
+        read into a fresh bytearray so the array can be modified in place."""
+        # numpy is only needed for raw frame access
+        import RawVideo
+        if timecode is not None:
+            frame_num = self.timecode_to_frame(timecode)
+        elif seconds is not None:
+            frame_num = self.seconds_to_frame(seconds)
+
+        frame = self._owner.get_stream_frame(self.stream_num, frame_num, writable)
+        if frame is None:
+            return None
+        return RawVideo.frame_array(self, frame.data)
+
+    def frame_types(self, head_size=FrameTypes.DEFAULT_HEAD_SIZE, workers=1):
+        """Returns a FrameTypes.FrameTypeTable for this stream, classifying
+        frames from the start of their payloads on the first call."""
+        if self._frame_types is None:
+            self._frame_types = FrameTypes.classify_stream(
+                self, head_size, workers)
+        return self._frame_types
+
+    def keyframes(self):
+        return self._owner.get_stream_keyframes(self.stream_num)
+
+    def read_frames(self, frame_nums, workers=1):
+        """Yields the frames of frame_nums in file order. See
+        AviInput.read_stream_frames."""
+        return self._owner.read_stream_frames(self.stream_num, frame_nums,
+            workers)
+
+    def extract_frames(self, name_template, frame_nums=None, workers=4,
+            max_in_flight=_EXTRACT_IN_FLIGHT):
+        """Writes the payload of each of frame_nums, or of every frame if
+        None, to its own file. See AviInput.extract_stream_frames."""
+        if frame_nums is None:
+            frame_nums = range(self.frame_count)
+        return self._owner.extract_stream_frames(self.stream_num, frame_nums,
+            name_template, workers, max_in_flight)
+
+    def set_frame_types(self, table):
+        """Supplies a previously saved FrameTypes.FrameTypeTable."""
+        if len(table) != self.frame_count:
+            raise ValueError("Expected {0} frame types, got {1}".format(
+                self.frame_count, len(table)))
+        self._frame_types = table
+
 
 class _AbsoluteField(object):
     def __init__(self, bytestream, pos=None):
@@ -240,8 +445,7 @@ class _ChunkWriter(object):
 
     def _write_header(self, byte_count):
         self._file.seek(self._start_pos)
-        self._file.write(struct.pack(
-            "<4sI", self._chunk_fcc, byte_count))
+        self._file.write(_CHUNK_HEADER.pack(self._chunk_fcc, byte_count))
         if self._list_fcc is not None:
             self._file.write(self._list_fcc)
         self._file.seek(0, os.SEEK_END)
@@ -261,9 +465,21 @@ class _OutputStreamState(object):
         self.header_field = None
         self.bitmap_info_field = None
 
+        # the data and index pointer of the last chunk written in full
+        self.last_data = None
+        self.last_pointer = None
+        # content digest -> index pointer, for REPEAT_REFERENCE, least
+        # recently used first
+        self.chunks = collections.OrderedDict()
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
 
 class AviOutput(object):
-    def __init__(self, bytestream, debug=None):
+    def __init__(self, bytestream, debug=None, index_spill_size=_INDEX_SPILL_SIZE,
+            repeat_policy=REPEAT_COPY, repeat_cache_size=_REPEAT_CACHE_SIZE):
         self._file = bytestream
         self._riff = self._new_chunk(b"RIFF", b"AVI ")
 
@@ -280,7 +496,21 @@ class AviOutput(object):
 
         self.video_streams = [ ]
         self._stream_states = None
-        self._frame_index = bytearray()
+        # one of the REPEAT_ constants. repeats are detected by the frame
+        # data being the same bytes object as last time, or having the same
+        # content
+        self.repeat_policy = repeat_policy
+        # REPEAT_REFERENCE only finds repeats among the last
+        # repeat_cache_size distinct chunks of each stream, which bounds its
+        # memory use on long renders
+        self.repeat_cache_size = repeat_cache_size
+        # set once an index entry points back at an earlier chunk, so that
+        # readers know to follow the index rather than file order
+        self._must_use_index = False
+        # index entries stay in memory up to index_spill_size bytes, then
+        # move to a temporary file, so memory use doesn't grow with length
+        self._frame_index = tempfile.SpooledTemporaryFile(
+            max_size=index_spill_size)
 
         self._log = _Logger(debug)
 
@@ -307,33 +537,154 @@ class AviOutput(object):
         if avi_frame is None:
             return
 
-        if self._avih_field is None:
-            self._write_hdrl()
-        if self._movi is None:
-            self._begin_movi()
-        if self._rate_monitor is None:
-            self._rate_monitor = _RateMonitor(self.frame_rate, self.frame_rate * 0.5)
+        self._begin_frames()
+
+        state = self._stream_states[stream_num]
+        data = avi_frame.data
+        chunk_name = _pack_frame_fcc(stream_num, avi_frame.frame_type)
+
+        # only bytes can't have changed since they were last written
+        same = isinstance(data, bytes) and data is state.last_data
 
-        chunk_name = _VFRAME_ID_FORMAT.format(stream_num, avi_frame.frame_type).encode(_CP_WINDOWS)
+        digest = None
+        repeat_of = None
+        if self.repeat_policy == REPEAT_EMPTY:
+            if same or (state.last_data is not None and
+                    data == state.last_data):
+                repeat_of = state.last_pointer
+        elif self.repeat_policy == REPEAT_REFERENCE:
+            if same:
+                repeat_of = state.last_pointer
+            else:
+                digest = _digest(data)
+                repeat_of = state.chunks.get(digest)
+                if repeat_of is not None:
+                    state.chunks.move_to_end(digest)
+
+        if repeat_of is not None:
+            if self.repeat_policy == REPEAT_EMPTY:
+                offset = self._file.tell()
+                self._new_chunk(chunk_name).close()
+                self._rate_monitor.sample(8)
+                self._add_index_entry(chunk_name, 0, offset - self._movi_offset, 0)
+            else:
+                self._rate_monitor.sample(0)
+                self._add_index_entry(*repeat_of)
+                self._must_use_index = True
+        else:
+            offset = self._file.tell()
+
+            chunk = self._new_chunk(chunk_name)
+            self._file.write(data)
+            chunk.close()
+
+            pointer = _IndexPointer(chunk_name, avi_frame.flags,
+                offset - self._movi_offset, len(data))
+            self._rate_monitor.sample(len(data) + 8)
+            self._add_index_entry(*pointer)
+
+            if self.repeat_policy != REPEAT_COPY:
+                if isinstance(data, bytes):
+                    state.last_data = data
+                elif self.repeat_policy == REPEAT_EMPTY:
+                    # the caller may change a buffer and write it again, so
+                    # compare against its content as written
+                    state.last_data = bytes(data)
+                else:
+                    state.last_data = None
+                state.last_pointer = pointer
+                if digest is not None:
+                    state.chunks[digest] = pointer
+                    if len(state.chunks) > self.repeat_cache_size:
+                        state.chunks.popitem(last=False)
+
+        self.video_streams[stream_num].frame_count += 1
+
+    def write_stream_frame_parts(self, stream_num, frame_type, flags, parts):
+        """Writes a frame whose data is given as a sequence of buffers, which
+        are written in order without being joined first. Repeat detection
+        doesn't apply to frames written this way."""
+        self._begin_frames()
+
+        chunk_name = _pack_frame_fcc(stream_num, frame_type)
         offset = self._file.tell()
 
         chunk = self._new_chunk(chunk_name)
-        self._file.write(avi_frame.data)
+        size = 0
+        for part in parts:
+            size += self._file.write(part)
         chunk.close()
 
-        self._rate_monitor.sample(len(avi_frame.data) + 8)
+        self._rate_monitor.sample(size + 8)
+        self._add_index_entry(chunk_name, flags, offset - self._movi_offset, size)
 
-        e = OldIndexEntry()
-        e.ChunkId = chunk_name
-        e.Flags = avi_frame.flags
-        e.Offset = offset - self._movi_offset
-        e.Size = len(avi_frame.data)
-
-        self._frame_index.extend(e.pack())
+        # the next frame can't be a repeat of one written before this
+        state = self._stream_states[stream_num]
+        state.last_data = None
+        state.last_pointer = None
 
         self.video_streams[stream_num].frame_count += 1
 
+    def append_movi(self, avi_input, block_size=_COPY_BLOCK_SIZE):
+        """Copies the whole movi payload of avi_input to the output in blocks
+        of block_size bytes and appends its index with offsets shifted to
+        match. The streams of avi_input should be checked against this
+        output's basis streams with check_compatible first.
+
+        The output numbers its video streams from 0. If avi_input numbers
+        its video streams otherwise, such as when an audio stream comes
+        first, or has chunks of other streams in movi, its video chunks are
+        instead copied one at a time with their stream numbers changed."""
+        if len(avi_input.video_streams) != len(self.video_streams):
+            raise CompatibilityError("Expected {0} video streams, got {1}".format(
+                len(self.video_streams), len(avi_input.video_streams)))
+
+        stream_map = { }
+        for in_vs, out_vs in zip(avi_input.video_streams, self.video_streams):
+            stream_map[in_vs.stream_num] = out_vs.stream_num
+
+        avi_input._require_index()
+        if avi_input._aux_index or any(
+                n != m for n, m in stream_map.items()):
+            self._append_chunks(avi_input, stream_map)
+            return
+
+        self._begin_frames()
+
+        # source offsets are relative to its 'movi' fourcc, which isn't copied
+        shift = self._file.tell() - self._movi_offset - 4
+
+        self._file.flush()
+        avi_input._copy_movi(self._file, block_size)
+        # its index is copied as is, including any entries pointing back
+        if avi_input.file_header.Flags & F_MUSTUSEINDEX:
+            self._must_use_index = True
+
+        for stream_num, entry in avi_input._merged_index():
+            self._rate_monitor.sample(entry.size + 8)
+            self._add_index_entry(entry.chunk_id, entry.flags,
+                entry.offset + shift, entry.size)
+            self.video_streams[stream_num].frame_count += 1
+
+    def _append_chunks(self, avi_input, stream_map):
+        for stream_num, entry in avi_input._merged_index():
+            self.write_stream_frame(stream_map[stream_num], AviFrame(None,
+                entry.chunk_id[2:], entry.flags, avi_input._read_payload(entry)))
+
+    def _begin_frames(self):
+        if self._avih_field is None:
+            self._write_hdrl()
+        if self._movi is None:
+            self._begin_movi()
+        if self._rate_monitor is None:
+            self._rate_monitor = _RateMonitor(self.frame_rate, self.frame_rate * 0.5)
+
+    def _add_index_entry(self, chunk_id, flags, offset, size):
+        self._frame_index.write(
+            OldIndexEntry.codec.pack(chunk_id, flags, offset, size))
+
     def close(self):
+        self._begin_frames()
         if self._movi:
             self._movi.close()
             self._movi = None
@@ -348,13 +699,16 @@ class AviOutput(object):
         h.MicroSecPerFrame = self.microseconds_per_frame()
         h.MaxBytesPerSec = int(math.ceil(self._rate_monitor.max()))
         h.PaddingGranularity = 0
-        h.Flags = F_HASINDEX | F_ISINTERLEAVED
+        if self._must_use_index:
+            h.Flags = F_HASINDEX | F_MUSTUSEINDEX
+        else:
+            h.Flags = F_HASINDEX | F_ISINTERLEAVED
         h.TotalFrames = sum(vs.frame_count for vs in self.video_streams)
         h.InitialFrames = 0
         h.Streams = len(self.video_streams)
         h.SuggestedBufferSize = max(vs.suggested_buffer_size for vs in self.video_streams)
         h.Width = self.width
-        h.Height = self.height
+        h.Height = abs(self.height)
 
         self._log.write("MaxBytesPerSec measured as {0}".format(h.MaxBytesPerSec))
 
@@ -392,7 +746,7 @@ class AviOutput(object):
         sh.Priority = 0
         sh.Language = 0
         sh.InitialFrames = 0
-        sh.Scale = 1e3
+        sh.Scale = 1000
         sh.Rate = int(vs.frame_rate * 1e3)
         sh.Start = 0
         sh.Length = vs.frame_count
@@ -402,12 +756,12 @@ class AviOutput(object):
         sh.left = 0
         sh.top = 0
         sh.right = vs.width
-        sh.bottom = vs.height
+        sh.bottom = abs(vs.height)
 
         state.header_field.update(sh.pack())
 
         bih = BitmapInfoHeader()
-        bih.Size = sizeof(BitmapInfoHeader)
+        bih.Size = BitmapInfoHeader.codec.size
         bih.Width = vs.width
         bih.Height = vs.height
         bih.Planes = 1
@@ -427,7 +781,9 @@ class AviOutput(object):
 
     def _write_index(self):
         idx1 = self._new_chunk(b"idx1")
-        self._file.write(self._frame_index)
+        self._frame_index.seek(0, os.SEEK_SET)
+        shutil.copyfileobj(self._frame_index, self._file, _COPY_BLOCK_SIZE)
+        self._frame_index.close()
         idx1.close()
 
     def _alloc_struct_chunk(self, fcc, named_struct):
@@ -441,6 +797,146 @@ class AviOutput(object):
         return _ChunkWriter(self._file, chunk_fcc, list_fcc)
 
 
+class AviEditor(object):
+    """Changes the frame sequence of an existing AVI file in place.
+
+    The file is rewritten from the end of the movi list onwards: any new
+    chunks are appended to movi, followed by a new idx1. Frames that are
+    reordered, dropped or repeated only cost an index entry each, because
+    idx1 can point at the same chunk as many times as needed. The file must
+    be opened for reading and writing, and must not have anything other
+    than idx1 or JUNK after its movi list.
+
+    The old idx1 is truncated away before the new chunks and idx1 are
+    written, so if close() fails partway, the file is left without an
+    index. AviInput can still read it by scanning movi, but edit a copy if
+    the original matters.
+
+    When a sequence reorders or repeats chunks, the file header is flagged
+    as needing its index, so that players present frames in index order
+    rather than file order.
+    """
+
+    def __init__(self, bytestream, debug=None):
+        self._file = bytestream
+        self._input = AviInput(bytestream, debug)
+        self._sequences = { }
+        self._log = _Logger(debug)
+
+        self.video_streams = self._input.video_streams
+
+    def get_frame(self, frame_num=None, seconds=None, timecode=None):
+        return self._input.get_frame(frame_num, seconds, timecode)
+
+    def get_stream_frame(self, stream_num, frame_num):
+        return self._input.get_stream_frame(stream_num, frame_num)
+
+    def set_frames(self, frames):
+        self.set_stream_frames(self.video_streams[0].stream_num, frames)
+
+    def set_stream_frames(self, stream_num, frames):
+        """Sets the new frame sequence of a stream. Each item of frames is
+        either an int, referring to a frame number in the original file, or
+        an AviFrame with new data to append to the file."""
+        index = self._input._stream_indices[stream_num]
+        sequence = [ ]
+        for f in frames:
+            if isinstance(f, AviFrame):
+                sequence.append(f)
+            elif 0 <= f < len(index):
+                sequence.append(index[f])
+            else:
+                raise IndexError("Frame {0} out of range".format(f))
+        self._sequences[stream_num] = sequence
+
+    def close(self):
+        if self._sequences:
+            self._rewrite()
+        self._file = None
+
+    def _rewrite(self):
+        avi = self._input
+        if not avi._tail_is_index_only():
+            raise FormatError("Can't edit in place: movi is not followed by idx1")
+
+        self._file.seek(avi._movi_end(), os.SEEK_SET)
+        self._file.truncate()
+
+        written = { }
+        tracks = [ ]
+        out_of_order = False
+        for stream_num, sequence in sorted(self._sequences.items()):
+            track = [ ]
+            for item in sequence:
+                if isinstance(item, AviFrame):
+                    if id(item) not in written:
+                        written[id(item)] = self._append_chunk(stream_num, item)
+                    item = written[id(item)]
+                track.append(item)
+            tracks.append(track)
+            out_of_order = out_of_order or any(
+                p.offset >= q.offset for p, q in zip(track, track[1:]))
+            avi._stream_indices[stream_num] = track
+        avi._last_frame = None
+
+        for stream_num, index in sorted(avi._stream_indices.items()):
+            if stream_num not in self._sequences:
+                tracks.append(index)
+
+        aux = collections.defaultdict(list)
+        for pointer in avi._aux_index:
+            aux[pointer.chunk_id[:2]].append(pointer)
+        tracks.extend(aux.values())
+
+        movi_end = self._file.tell()
+        self._write_index(_interleave(tracks))
+        self._log.write("Wrote {0} bytes from {1:x}",
+            self._file.tell() - movi_end, movi_end)
+
+        self._update_size(avi._movi_offset - 8, movi_end - avi._movi_offset)
+        self._update_size(0, self._file.tell() - 8)
+
+        for vs in self.video_streams:
+            vs.frame_count = len(avi._stream_indices[vs.stream_num])
+
+        h = avi.file_header
+        h.Flags |= F_HASINDEX
+        if out_of_order:
+            h.Flags = (h.Flags | F_MUSTUSEINDEX) & ~F_ISINTERLEAVED
+        h.TotalFrames = sum(vs.frame_count for vs in self.video_streams)
+        _AbsoluteField(self._file, avi._avih_pos).update(h.pack())
+
+        for stream_num in self._sequences:
+            sh = avi._stream_data[stream_num].header
+            sh.Length = len(avi._stream_indices[stream_num])
+            _AbsoluteField(self._file, avi._strh_positions[stream_num]).update(
+                sh.pack())
+
+        self._file.flush()
+
+    def _append_chunk(self, stream_num, avi_frame):
+        chunk_name = _pack_frame_fcc(stream_num, avi_frame.frame_type)
+        offset = self._file.tell() - self._input._movi_offset
+
+        chunk = _ChunkWriter(self._file, chunk_name)
+        self._file.write(avi_frame.data)
+        chunk.close()
+
+        return _IndexPointer(chunk_name, avi_frame.flags, offset,
+            len(avi_frame.data))
+
+    def _write_index(self, pointers):
+        # _IndexPointer fields are in the same order as OldIndexEntry's
+        index = OldIndexEntry.pack_array(pointers)
+
+        idx1 = _ChunkWriter(self._file, b"idx1")
+        self._file.write(index)
+        idx1.close()
+
+    def _update_size(self, pos, size):
+        _AbsoluteField(self._file, pos + 4).update(_CHUNK_SIZE.pack(size))
+
+
 def _default_log_func(m):
     print(m, file=sys.stderr)
 
@@ -465,7 +961,7 @@ class _Logger(object):
 
     def _writeobj(self, obj):
         try:
-            d = obj.__dict__
+            d = obj._asdict() if hasattr(obj, "_asdict") else obj.__dict__
             self._log_func(pprint.pformat(d))
         except AttributeError:
             self._log_func(repr(obj))
@@ -475,7 +971,22 @@ class _Logger(object):
 
 
 class AviInput(object):
-    def __init__(self, bytestream, debug=None):
+    def __init__(self, bytestream, debug=None, cache_block_size=None,
+            recover=False, lazy=False):
+        # bytestream can be any seekable binary file object, including a
+        # BlockCache.CachedReader over a custom range source. Setting
+        # cache_block_size wraps bytestream in a CachedReader with that
+        # block size, which helps when small reads are expensive.
+        # If recover is True and the file has no usable idx1, the index is
+        # rebuilt with Recovery.scan_movi, which resynchronizes past damaged
+        # chunk headers instead of trusting them, and damage is set to its
+        # DamageReport.
+        # If lazy is True, only the headers are read on open, and the index
+        # is loaded when first needed, such as by reading a frame or asking
+        # for a stream's frame_count
+        if cache_block_size is not None:
+            bytestream = BlockCache.CachedReader(
+                BlockCache.StreamSource(bytestream), cache_block_size)
         self._file = bytestream
 
         self.file_header = None
@@ -484,45 +995,274 @@ class AviInput(object):
         self.video_streams = None
         self._stream_data = None
         self._stream_indices = None
+        # index entries for chunks that don't belong to video streams
+        self._aux_index = None
 
+        self._avih_pos = None
+        self._strh_positions = None
+        self._hdrl_end = None
         self._movi_offset = None
+        self._movi_length = None
+
+        self._recover = recover
+        self._lazy = lazy
+        self.damage = None
+
+        # the last frame returned by get_stream_frame, handed out again when
+        # it's asked for twice in a row, which also lets AviOutput spot
+        # repeats without comparing data
+        self._last_frame = None
+
+        # set by SharedIndex to the shared memory or mapping the index views
+        self._shared_memory = None
 
         self._log = _Logger(debug)
 
-        self._parse()
+        if bytestream is not None:
+            self._parse()
+
+    @classmethod
+    def _from_state(cls, bytestream, file_header, stream_data, movi_offset,
+            movi_length, stream_indices, aux_index, debug=None):
+        # builds an input from already parsed headers and indices, such as
+        # ones shared between processes, without reading bytestream
+        avi = cls(None, debug)
+        avi._file = bytestream
+        avi.file_header = file_header
+        avi.max_bytes_per_sec = file_header.MaxBytesPerSec
+        avi.video_streams = [ ]
+        avi._stream_data = [ ]
+        for info in stream_data:
+            avi._add_stream(info)
+        avi._movi_offset = movi_offset
+        avi._movi_length = movi_length
+        avi._stream_indices = stream_indices
+        avi._aux_index = aux_index
+        for vs in avi.video_streams:
+            vs.frame_count = len(stream_indices[vs.stream_num])
+        return avi
+
+    def close(self):
+        # drops the index, and then closes any shared memory it was viewing,
+        # which can't be closed while views remain. bytestream is left open
+        self._stream_indices = None
+        self._aux_index = None
+        self._last_frame = None
+        if self._shared_memory is not None:
+            self._shared_memory.close()
+            self._shared_memory = None
 
     def get_frame(self, frame_num=None, seconds=None, timecode=None):
         # convenience method which maps to the get_frame method of the
         # first video stream, which is by far the common case
         return self.video_streams[0].get_frame(frame_num, seconds, timecode)
 
-    def get_stream_frame(self, stream_num, frame_num):
+    def get_stream_frame(self, stream_num, frame_num, writable=False):
+        # if writable is True, the frame's data is a bytearray of its own
+        self._require_index()
         index = self._stream_indices[stream_num]
 
         if frame_num < 0 or frame_num >= len(index):
             return None
 
+        if not writable and self._last_frame is not None and \
+                self._last_frame[0] == stream_num and \
+                self._last_frame[1].frame_num == frame_num:
+            return self._last_frame[1]
+
         frame_info = index[frame_num]
 
         frame_type = frame_info.chunk_id[2:]
 
+        data = self._read_payload(frame_info, writable)
+
+        frame = AviFrame(frame_num, frame_type, frame_info.flags, data)
+        if not writable:
+            self._last_frame = (stream_num, frame)
+        return frame
+
+    def get_stream_keyframes(self, stream_num):
+        self._require_index()
+        return [ n for n, p in enumerate(self._stream_indices[stream_num])
+            if p.flags & IF_KEYFRAME ]
+
+    def extract_stream_frames(self, stream_num, frame_nums, name_template,
+            workers=4, max_in_flight=_EXTRACT_IN_FLIGHT):
+        """Writes the payload of each of frame_nums to its own file and
+        returns the number of files written.
+
+        Frames are read in file order with nearby reads merged, and written
+        from a pool of workers threads. Reading pauses while more than
+        max_in_flight bytes are waiting to be written. File names are made
+        with name_template.format(), which is passed the fields frame_num,
+        frame_type, seconds and timecode. The timecode is separated with '-'
+        so that it is usable in file names.
+        """
+        vs = self._video_stream(stream_num)
+        self._require_index()
+        index = self._stream_indices[stream_num]
+
+        requests = [ ]
+        for frame_num in frame_nums:
+            p = index[frame_num]
+            requests.append((self._movi_offset + p.offset + 8, p.size, frame_num))
+
+        budget = _ByteBudget(max_in_flight)
+        errors = [ ]
+
+        def write_file(path, data):
+            try:
+                with open(path, "wb") as out:
+                    out.write(data)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                budget.release(len(data))
+
+        count = 0
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for members, buf in self._read_runs(_coalesce_reads(requests), 1):
+                view = memoryview(buf)
+                for pos, length, frame_num in members:
+                    if errors:
+                        raise errors[0]
+                    path = name_template.format(
+                        frame_num=frame_num,
+                        frame_type=index[frame_num].chunk_id[2:].decode(_CP_WINDOWS),
+                        seconds=frame_num / vs.frame_rate,
+                        timecode=Timecode.format_timecode(
+                            frame_num, vs.frame_rate, separator="-"))
+                    budget.acquire(length)
+                    executor.submit(write_file, path, view[pos:pos + length])
+                    count += 1
+
+        if errors:
+            raise errors[0]
+        return count
+
+    def _read_payload(self, pointer, writable=False):
         # +8 to skip chunk header
-        self._file.seek(self._movi_offset + frame_info.offset + 8)
-        data = self._file.read(frame_info.size)
+        self._file.seek(self._movi_offset + pointer.offset + 8)
+        if writable:
+            data = bytearray(pointer.size)
+            got = self._file.readinto(data)
+            del data[got:]
+            return data
+        return self._file.read(pointer.size)
+
+    def _video_stream(self, stream_num):
+        for vs in self.video_streams:
+            if vs.stream_num == stream_num:
+                return vs
+        raise IndexError("No video stream #{0}".format(stream_num))
+
+    def read_stream_frames(self, stream_num, frame_nums, workers=1):
+        """Reads each of frame_nums, merging reads of nearby frames, and
+        yields AviFrames in file order rather than the order given. If
+        workers > 1 and the file has a descriptor, reads are issued from
+        that many threads."""
+        self._require_index()
+        index = self._stream_indices[stream_num]
 
-        return AviFrame(frame_num, frame_type, frame_info.flags, data)
+        requests = [ ]
+        for frame_num in frame_nums:
+            p = index[frame_num]
+            requests.append((self._movi_offset + p.offset + 8, p.size, frame_num))
+
+        for members, buf in self._read_runs(
+                _coalesce_reads(requests), workers):
+            for pos, length, frame_num in members:
+                p = index[frame_num]
+                yield AviFrame(frame_num, p.chunk_id[2:], p.flags,
+                    buf[pos:pos + length])
+
+    def read_frame_heads(self, stream_num, frame_nums, size, workers=1):
+        """Reads up to size bytes from the start of the payload of each of
+        frame_nums, merging reads of nearby frames, and yields
+        (frame_num, flags, frame_size, head) tuples in file order. If
+        workers > 1 and the file has a descriptor, reads are issued from
+        that many threads."""
+        self._require_index()
+        index = self._stream_indices[stream_num]
+        if size <= 0:
+            for frame_num in frame_nums:
+                p = index[frame_num]
+                yield (frame_num, p.flags, p.size, b"")
+            return
+
+        requests = [ ]
+        for frame_num in frame_nums:
+            p = index[frame_num]
+            requests.append((self._movi_offset + p.offset + 8,
+                min(size, p.size), frame_num))
+
+        for members, buf in self._read_runs(
+                _coalesce_reads(requests), workers):
+            for pos, length, frame_num in members:
+                p = index[frame_num]
+                yield (frame_num, p.flags, p.size, buf[pos:pos + length])
+
+    def _read_runs(self, runs, workers):
+        # yields (requests relative to the buffer, buffer) for each run
+        def rebase(run):
+            run_pos, _, members = run
+            return [ (pos - run_pos, length, tag)
+                for pos, length, tag in members ]
+
+        fd = None
+        if workers > 1:
+            try:
+                fd = self._file.fileno()
+            except (AttributeError, io.UnsupportedOperation):
+                pass
+
+        if fd is None:
+            for run in runs:
+                self._file.seek(run[0], os.SEEK_SET)
+                yield rebase(run), self._file.read(run[1])
+            return
+
+        def read_run(run):
+            return rebase(run), os.pread(fd, run[1], run[0])
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for result in _bounded_map(executor, read_run, runs, workers * 2):
+                yield result
 
     def _parse(self):
         self._require_chunk(b"RIFF", b"AVI ")
         self._parse_hdrl()
+        self._hdrl_end = self._file.tell()
+
+        if not self._lazy:
+            self._load_index()
+
+    def _require_index(self):
+        if self._stream_indices is None:
+            self._load_index()
 
+    def _load_index(self):
+        self._file.seek(self._hdrl_end, os.SEEK_SET)
         movi = self._find_chunk(b"LIST", b"movi")
+        if movi is None:
+            raise FormatError("movi list not found")
         self._movi_offset = self._file.tell() - 4
+        self._movi_length = movi.content_length
         self._log.write("movi_offset = {0:x}", self._movi_offset)
         self._skip_chunk(movi)
 
-        if self._parse_idx1():
+        try:
+            has_idx1 = self._parse_idx1()
+        except FormatError:
+            # a damaged movi size can leave us anywhere
+            if not self._recover:
+                raise
+            has_idx1 = False
+
+        if has_idx1:
             self._check_index_offsets()
+        elif self._recover:
+            self._recover_index()
         else:
             self._build_index()
 
@@ -533,6 +1273,7 @@ class AviInput(object):
     def _parse_hdrl(self):
         self._require_chunk(b"LIST", b"hdrl")
         avih = self._require_chunk(b"avih")
+        self._avih_pos = self._file.tell()
         self.file_header = self._read_struct_chunk(avih, MainHeader)
         self.max_bytes_per_sec = self.file_header.MaxBytesPerSec
 
@@ -541,6 +1282,7 @@ class AviInput(object):
 
         self.video_streams = [ ]
         self._stream_data = [ ]
+        self._strh_positions = [ ]
         while self._parse_stream():
             pass
 
@@ -561,6 +1303,7 @@ class AviInput(object):
         self._log.write("Stream definition #{0}".format(len(self._stream_data)))
 
         strh = self._require_chunk(b"strh")
+        self._strh_positions.append(self._file.tell())
         stream_header = self._read_struct_chunk(strh, StreamHeader)
 
         self._log.write("Stream header")
@@ -589,6 +1332,13 @@ class AviInput(object):
         else:
             self._put_back(c)
 
+        self._add_stream(StreamInfo(
+            stream_header, bitmap_info, codec_data, stream_name))
+
+        return True
+
+    def _add_stream(self, info):
+        stream_header, bitmap_info, codec_data, _ = info
         if bitmap_info is not None:
             vs = InputVideoStream(self)
 
@@ -604,93 +1354,145 @@ class AviInput(object):
             vs.bit_depth = bitmap_info.BitCount
             vs.compression = bitmap_info.Compression
             vs.size_image = bitmap_info.SizeImage
+            vs.declared_frame_count = (stream_header.Length or
+                self.file_header.TotalFrames)
 
             self.video_streams.append(vs)
 
-        self._stream_data.append(StreamInfo(
-            stream_header, bitmap_info, codec_data, stream_name))
-
-        return True
+        self._stream_data.append(info)
 
     def _parse_idx1(self):
         idx1 = self._next_chunk()
-        if idx1.fcc != b"idx1":
+        if idx1 is None or idx1.fcc != b"idx1":
             self._log.write("idx1 not present")
-            self._put_back(idx1)
+            if idx1 is not None:
+                self._put_back(idx1)
             return False
 
         self._log.write("idx1 present")
 
         si = collections.defaultdict(list)
-        entry_count = idx1.content_length // sizeof(OldIndexEntry)
-        for _ in range(entry_count):
-            entry = self._read_struct(OldIndexEntry)
-            if entry.Flags & IF_LIST == 0:
-                stream_num, _ = _unpack_frame_fcc(entry.ChunkId)
+        aux = [ ]
+        # read the whole index at once, including any slack space at the end
+        data = self._file.read(idx1.file_length)
+        entry_count = min(idx1.content_length, len(data)) // OldIndexEntry.codec.size
+        for entry in OldIndexEntry.unpack_array(data, entry_count):
+            # entry is a (ChunkId, Flags, Offset, Size) tuple
+            if entry[1] & IF_LIST == 0:
+                pointer = _IndexPointer._make(entry)
+                stream_num, _ = _unpack_frame_fcc(pointer.chunk_id)
                 if stream_num is not None:
-                    si[stream_num].append(_IndexPointer(
-                        entry.ChunkId,
-                        entry.Flags,
-                        entry.Offset,
-                        entry.Size))
-
-                    self._log.write("#{0}: {1}",
-                        stream_num,
-                        pprint.pformat(entry.__dict__))
+                    si[stream_num].append(pointer)
 
-        # skip any slack space at the end of the idx1 data
-        self._file.seek(
-            idx1.file_length - entry_count * sizeof(OldIndexEntry),
-            os.SEEK_CUR)
+                    self._log.write("#{0}: {1}", stream_num, pointer)
+                else:
+                    aux.append(pointer)
 
         self._stream_indices = si
+        self._aux_index = aux
         return True
 
     def _check_index_offsets(self):
+        fix_aux = False
         for index, track in self._stream_indices.items():
             if len(track) > 0:
                 f = track[0]
                 self._file.seek(self._movi_offset + f.offset)
                 if self._file.read(4) != f.chunk_id:
                     print("Fixing offsets for track #{0}".format(index))
-                    for g in track:
-                        g.offset -= self._movi_offset
+                    track[:] = [ g._replace(offset=g.offset - self._movi_offset)
+                        for g in track ]
+                    fix_aux = True
                 else:
                     print("Offsets for track #{0} are correct".format(index))
 
+        if fix_aux:
+            self._aux_index = [ g._replace(offset=g.offset - self._movi_offset)
+                for g in self._aux_index ]
+
     def _build_index(self):
         si = collections.defaultdict(list)
+        aux = [ ]
 
         self._file.seek(self._movi_offset, os.SEEK_SET)
 
         check = self._file.read(4)
         assert check == b"movi", "_movi_offset should point to 'movi' string"
 
-        while True:
+        movi_end = self._movi_end()
+        while self._file.tell() < movi_end:
             c = self._next_chunk()
             if c is None:
                 break
             elif c.fcc != b"LIST":
+                pointer = _IndexPointer(
+                    c.fcc,
+                    0,
+                    self._file.tell() - c.header_size - self._movi_offset,
+                    c.content_length)
                 stream_num, _ = _unpack_frame_fcc(c.fcc)
                 if stream_num is not None:
-                    si[stream_num].append(_IndexPointer(
-                        c.fcc,
-                        0,
-                        self._file.tell() - c.header_size,
-                        c.content_length))
+                    si[stream_num].append(pointer)
+                elif _STREAM_CHUNK_PATTERN.match(c.fcc):
+                    aux.append(pointer)
                 self._skip_chunk(c)
 
         self._stream_indices = si
+        self._aux_index = aux
+
+    def _recover_index(self):
+        import Recovery
+        recovered = Recovery.scan_movi(self._file, self._movi_offset,
+            self._movi_length, len(self._stream_data))
+        self._stream_indices = recovered.stream_indices
+        self._aux_index = recovered.aux_index
+        self._movi_length = recovered.movi_length
+        self.damage = recovered.damage
+        self._log.write("Recovered index: {0!r}", self.damage)
+
+    def _movi_end(self):
+        return self._movi_offset + 4 + self._movi_length + (self._movi_length & 1)
+
+    def _tail_is_index_only(self):
+        # True if nothing but idx1 and JUNK follows the movi list
+        self._require_index()
+        self._file.seek(self._movi_end(), os.SEEK_SET)
+        while True:
+            c = self._next_chunk()
+            if c is None:
+                return True
+            if c.fcc != b"idx1":
+                return False
+            self._skip_chunk(c)
 
-    def _read_struct(self, structure_cls):
-        return read_structure(self._file, structure_cls)
-
-    def _read_struct_chunk(self, chunk, structure_cls):
-        structure = self._read_struct(structure_cls)
-        slack = chunk.file_length - sizeof(structure_cls)
-        if slack > 0:
-            self._file.seek(slack, os.SEEK_CUR)
-        return structure
+    def _merged_index(self):
+        # all stream indices as (stream_num, _IndexPointer) in file order
+        self._require_index()
+        return heapq.merge(
+            *(((n, p) for p in index)
+                for n, index in sorted(self._stream_indices.items())),
+            key=lambda t: t[1].offset)
+
+    def _copy_movi(self, dest, block_size):
+        # copies the content of the movi list, excluding the 'movi' fourcc
+        self._require_index()
+        self._file.seek(self._movi_offset + 4, os.SEEK_SET)
+        remain = self._movi_length
+        while remain > 0:
+            block = self._file.read(min(block_size, remain))
+            if len(block) == 0:
+                raise FormatError("movi list truncated by {0} bytes".format(remain))
+            dest.write(block)
+            remain -= len(block)
+
+    def _read_struct_chunk(self, chunk, record_cls):
+        # reads the chunk including any slack in a single read, zero-filling
+        # chunks that are shorter than the record
+        data = self._file.read(chunk.file_length)
+        shortfall = record_cls.codec.size - len(data)
+        if shortfall > 0:
+            data += bytes(shortfall)
+        return record_cls.unpack_from(data)
 
     def _read_chunk_content(self, chunk):
         return self._file.read(chunk.file_length)[:chunk.content_length]
@@ -717,7 +1519,9 @@ class AviInput(object):
             content_read = 0
             if len(h) == 0:
                 return None
-            fcc, content_length = struct.unpack("<4sI", h)
+            if len(h) < _CHUNK_HEADER.size:
+                raise FormatError("Truncated chunk header")
+            fcc, content_length = _CHUNK_HEADER.unpack(h)
             file_length = content_length + (content_length & 1)
 
             if fcc == b"JUNK":
@@ -0,0 +1,187 @@
+import collections
+import io
+import os
+
+
+DEFAULT_BLOCK_SIZE = 1 << 18
+DEFAULT_READ_AHEAD = 3
+DEFAULT_MAX_BLOCKS = 64
+
+
+class StreamSource(object):
+    """A range source over a seekable binary file object."""
+    def __init__(self, bytestream):
+        self._file = bytestream
+        self._size = None
+
+    def size(self):
+        if self._size is None:
+            pos = self._file.tell()
+            self._size = self._file.seek(0, os.SEEK_END)
+            self._file.seek(pos, os.SEEK_SET)
+        return self._size
+
+    def read_range(self, offset, length):
+        self._file.seek(offset, os.SEEK_SET)
+        return self._file.read(length)
+
+
+class BytesSource(object):
+    """A range source over an in-memory buffer, which counts the requests
+    made of it. Useful as a stand-in for remote or ranged-request sources."""
+    def __init__(self, data):
+        self._data = memoryview(data)
+        self.request_count = 0
+        self.bytes_requested = 0
+
+    def size(self):
+        return len(self._data)
+
+    def read_range(self, offset, length):
+        self.request_count += 1
+        chunk = self._data[offset:offset + length].tobytes()
+        self.bytes_requested += len(chunk)
+        return chunk
+
+
+class CacheStats(object):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.bytes_fetched = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total > 0:
+            return self.hits / total
+        return 0.0
+
+    def __repr__(self):
+        return ("CacheStats(hits={0}, misses={1}, bypassed={2}, evictions={3}, "
+            "bytes_fetched={4}, hit_rate={5:.3f})").format(self.hits,
+            self.misses, self.bypassed, self.evictions, self.bytes_fetched,
+            self.hit_rate())
+
+
+class CachedReader(io.RawIOBase):
+    """A read-only, seekable file object that serves reads from a cache of
+    fixed-size blocks fetched from a range source.
+
+    A source is any object with size() and read_range(offset, length)
+    methods, such as StreamSource or BytesSource. On a miss, the missing
+    block and up to read_ahead following blocks are fetched in one request.
+    At most max_blocks blocks are kept, evicting the least recently used.
+    Reads spanning more than half the cache, or more than one block when
+    it only holds one, go straight to the source.
+    """
+    def __init__(self, source, block_size=DEFAULT_BLOCK_SIZE,
+            read_ahead=DEFAULT_READ_AHEAD, max_blocks=DEFAULT_MAX_BLOCKS):
+        super(CachedReader, self).__init__()
+        self._source = source
+        self._size = source.size()
+        self._pos = 0
+
+        self.block_size = block_size
+        self.read_ahead = read_ahead
+        self.max_blocks = max(1, max_blocks)
+        self._blocks = collections.OrderedDict()
+
+        self.stats = CacheStats()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError("Invalid whence {0!r}".format(whence))
+        if pos < 0:
+            raise ValueError("Negative seek position {0}".format(pos))
+        self._pos = pos
+        return pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._pos
+        size = max(0, min(size, self._size - self._pos))
+        if size == 0:
+            return b""
+
+        first = self._pos // self.block_size
+        last = (self._pos + size - 1) // self.block_size
+        if last - first + 1 > max(1, self.max_blocks // 2):
+            self.stats.bypassed += 1
+            data = self._fetch(self._pos, size)
+        else:
+            parts = [ ]
+            pos = self._pos
+            remain = size
+            for block_num in range(first, last + 1):
+                block = self._get_block(block_num)
+                start = pos - block_num * self.block_size
+                part = block[start:start + remain]
+                parts.append(part)
+                pos += len(part)
+                remain -= len(part)
+            data = b"".join(parts)
+
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _get_block(self, block_num):
+        block = self._blocks.get(block_num)
+        if block is not None:
+            self.stats.hits += 1
+            self._blocks.move_to_end(block_num)
+            return block
+
+        self.stats.misses += 1
+
+        # fetch this block and any uncached blocks after it in one request,
+        # reading ahead no more than the cache can keep alongside it
+        count = 1
+        read_ahead = min(self.read_ahead, self.max_blocks - 1)
+        block_count = (self._size + self.block_size - 1) // self.block_size
+        while (count <= read_ahead and block_num + count < block_count and
+                block_num + count not in self._blocks):
+            count += 1
+
+        offset = block_num * self.block_size
+        data = self._fetch(offset, count * self.block_size)
+        block = data[:self.block_size]
+        self._store(block_num, block)
+        for i in range(1, count):
+            self._store(block_num + i,
+                data[i * self.block_size:(i + 1) * self.block_size])
+
+        return block
+
+    def _store(self, block_num, block):
+        self._blocks[block_num] = block
+        self._blocks.move_to_end(block_num)
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _fetch(self, offset, length):
+        data = self._source.read_range(offset, length)
+        self.stats.bytes_fetched += len(data)
+        return data
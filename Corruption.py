@@ -0,0 +1,173 @@
+import Avi
+
+import numpy as np
+
+import collections
+import concurrent.futures
+import os
+
+
+_START_CODE_LENGTH = 4
+
+
+# A mutation is any object with an apply(buf, rng) method, which changes
+# the writable uint8 array buf in place, drawing any randomness from the
+# numpy Generator rng. Mutations are pickled to worker processes.
+
+
+class ByteFlip(object):
+    """XORs a random fraction of bytes with random values, limited to the
+    bits set in mask."""
+    def __init__(self, rate, mask=0xFF):
+        self.rate = rate
+        self.mask = mask
+
+    def apply(self, buf, rng):
+        count = rng.binomial(len(buf), self.rate)
+        if count == 0:
+            return
+        pos = rng.integers(0, len(buf), count)
+        buf[pos] ^= rng.integers(1, 256, count, dtype=np.uint8) & self.mask
+
+
+class RunShuffle(object):
+    """Splits the buffer into runs of run_length bytes and shuffles a random
+    fraction of them among themselves."""
+    def __init__(self, run_length, rate):
+        self.run_length = run_length
+        self.rate = rate
+
+    def apply(self, buf, rng):
+        run_count = len(buf) // self.run_length
+        count = rng.binomial(run_count, self.rate)
+        if count < 2:
+            return
+        runs = buf[:run_count * self.run_length].reshape(run_count, self.run_length)
+        chosen = rng.choice(run_count, count, replace=False)
+        runs[chosen] = runs[rng.permutation(chosen)]
+
+
+class ZeroRange(object):
+    """Zeroes the bytes between two fractions of the buffer's length."""
+    def __init__(self, start, stop):
+        self.start = start
+        self.stop = stop
+
+    def apply(self, buf, rng):
+        buf[int(len(buf) * self.start):int(len(buf) * self.stop)] = 0
+
+
+class Corruptor(object):
+    """Applies a list of mutations to frame payloads.
+
+    Keyword arguments:
+    mutations -- Mutations, such as ByteFlip, applied in order.
+    seed -- Seeds the random generator for each frame together with the
+        frame number, so results don't depend on how frames are batched or
+        which process handles them.
+    preserve_head -- Number of bytes at the start of each frame to leave
+        intact, such as codec headers.
+    preserve_start_codes -- Whether to restore MPEG start codes
+        (00 00 01 xx) after mutating, so decoders stay in sync.
+    """
+    def __init__(self, mutations, seed=0, preserve_head=0,
+            preserve_start_codes=False):
+        self.mutations = list(mutations)
+        self.seed = seed
+        self.preserve_head = preserve_head
+        self.preserve_start_codes = preserve_start_codes
+
+    def corrupt(self, frame_num, data):
+        buf = np.frombuffer(data, dtype=np.uint8).copy()
+        body = buf[self.preserve_head:]
+        if len(body) == 0:
+            return data
+
+        if self.preserve_start_codes:
+            keep = _start_code_mask(body)
+            original = body[keep]
+
+        rng = np.random.default_rng([ self.seed, frame_num ])
+        for m in self.mutations:
+            m.apply(body, rng)
+
+        if self.preserve_start_codes:
+            body[keep] = original
+
+        return buf.tobytes()
+
+    def corrupt_frame(self, avi_frame):
+        return avi_frame._replace(
+            data=self.corrupt(avi_frame.frame_num, avi_frame.data))
+
+
+def _start_code_mask(buf):
+    mask = np.zeros(len(buf), dtype=bool)
+    if len(buf) < _START_CODE_LENGTH:
+        return mask
+    starts = np.flatnonzero(
+        (buf[:-3] == 0) & (buf[1:-2] == 0) & (buf[2:-1] == 1))
+    for i in range(_START_CODE_LENGTH):
+        mask[starts + i] = True
+    return mask
+
+
+def _corrupt_batch(corruptor, batch):
+    return [ corruptor.corrupt_frame(f) for f in batch ]
+
+
+def corrupt_frames(corruptor, frames, should_corrupt=None, workers=None,
+        batch_size=32, max_pending_batches=None):
+    """Corrupts an iterable of AviFrames across a pool of processes and
+    yields the results in the original order.
+
+    Frames are sent to workers in batches of batch_size, with at most
+    max_pending_batches (by default twice the number of workers) in flight.
+    If should_corrupt is given, frames for which it returns False are passed
+    through unchanged without being sent to a worker.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending_batches is None:
+        max_pending_batches = workers * 2
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        # each item is either a future for a batch, or a list of frames
+        # passed through
+        pending = collections.deque()
+        batch = [ ]
+
+        def flush_batch():
+            if batch:
+                pending.append(executor.submit(_corrupt_batch, corruptor, list(batch)))
+                del batch[:]
+
+        def drain(limit):
+            while len(pending) > limit:
+                item = pending.popleft()
+                if isinstance(item, concurrent.futures.Future):
+                    item = item.result()
+                for f in item:
+                    yield f
+
+        for f in frames:
+            if f is None:
+                continue
+            if should_corrupt is None or should_corrupt(f):
+                batch.append(f)
+                if len(batch) >= batch_size:
+                    flush_batch()
+            else:
+                flush_batch()
+                pending.append([ f ])
+
+            for out in drain(max_pending_batches):
+                yield out
+
+        flush_batch()
+        for out in drain(0):
+            yield out
+
+
+def is_delta_frame(avi_frame):
+    return not avi_frame.flags & Avi.IF_KEYFRAME
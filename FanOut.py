@@ -0,0 +1,147 @@
+import collections
+
+
+DEFAULT_MAX_HELD_BYTES = 1 << 28
+
+
+class OutputPlan(object):
+    """A sequence of source frame numbers to write, in order, to an
+    OutputVideoStream. If transform is given, each frame is passed through
+    it before writing, and a result of None skips that frame. Frames are
+    shared between plans, so transform should return a new frame rather
+    than modify the one it's given."""
+    def __init__(self, output_stream, frame_nums, transform=None):
+        self.output_stream = output_stream
+        self.frame_nums = list(frame_nums)
+        self.transform = transform
+
+
+class FanOutStats(object):
+    def __init__(self):
+        self.frames_read = 0
+        self.bytes_read = 0
+        self.frames_written = 0
+        # frames dropped to stay under the held byte limit, and read again
+        # when an output reached them
+        self.evictions = 0
+        self.rereads = 0
+        self.max_held_frames = 0
+        self.max_held_bytes = 0
+
+    def sample(self, held_frames, held_bytes):
+        self.max_held_frames = max(self.max_held_frames, held_frames)
+        self.max_held_bytes = max(self.max_held_bytes, held_bytes)
+
+    def __repr__(self):
+        return ("FanOutStats(frames_read={0}, bytes_read={1}, "
+            "frames_written={2}, evictions={3}, rereads={4}, "
+            "max_held_frames={5}, max_held_bytes={6})").format(
+            self.frames_read, self.bytes_read, self.frames_written,
+            self.evictions, self.rereads, self.max_held_frames,
+            self.max_held_bytes)
+
+
+class _PlanState(object):
+    def __init__(self, plan):
+        self.plan = plan
+        self.pos = 0
+
+    def done(self):
+        return self.pos >= len(self.plan.frame_nums)
+
+    def next_frame_num(self):
+        return self.plan.frame_nums[self.pos]
+
+    def write(self, frame):
+        if self.plan.transform is not None:
+            frame = self.plan.transform(frame)
+        self.plan.output_stream.write_frame(frame)
+        self.pos += 1
+
+
+class _FanOut(object):
+    def __init__(self, input_stream, plans, max_held_bytes):
+        self._input = input_stream
+        self._states = [ _PlanState(plan) for plan in plans ]
+        self._max_held_bytes = max_held_bytes
+
+        # source frame number -> writes of it still to come, over all plans
+        self._uses = collections.Counter()
+        for plan in plans:
+            self._uses.update(plan.frame_nums)
+        for frame_num in self._uses:
+            if not 0 <= frame_num < input_stream.frame_count:
+                raise IndexError("Frame {0} out of range".format(frame_num))
+
+        # frames read and still needed, oldest first
+        self._held = collections.OrderedDict()
+        self._held_bytes = 0
+        self._read = set()
+        # frame number -> plans that can't continue until it's read
+        self._waiting = collections.defaultdict(list)
+
+        self.stats = FanOutStats()
+
+    def run(self, workers):
+        for state in self._states:
+            self._advance(state)
+
+        for frame in self._input.read_frames(sorted(self._uses), workers):
+            self.stats.frames_read += 1
+            self.stats.bytes_read += len(frame.data)
+
+            self._read.add(frame.frame_num)
+            self._hold(frame)
+            for state in self._waiting.pop(frame.frame_num, ()):
+                self._advance(state)
+
+            while self._held_bytes > self._max_held_bytes and self._held:
+                self._release(next(iter(self._held)))
+                self.stats.evictions += 1
+
+        return self.stats
+
+    def _advance(self, state):
+        # writes the plan's frames for as long as they have been read
+        while not state.done():
+            frame_num = state.next_frame_num()
+            frame = self._held.get(frame_num)
+            if frame is None:
+                if frame_num not in self._read:
+                    self._waiting[frame_num].append(state)
+                    return
+                frame = self._input.get_frame(frame_num)
+                self.stats.rereads += 1
+
+            state.write(frame)
+            self.stats.frames_written += 1
+
+            self._uses[frame_num] -= 1
+            if self._uses[frame_num] == 0 and frame_num in self._held:
+                self._release(frame_num)
+
+    def _hold(self, frame):
+        self._held[frame.frame_num] = frame
+        self._held_bytes += len(frame.data)
+        self.stats.sample(len(self._held), self._held_bytes)
+
+    def _release(self, frame_num):
+        frame = self._held.pop(frame_num)
+        self._held_bytes -= len(frame.data)
+
+
+def fan_out(input_stream, plans, workers=1,
+        max_held_bytes=DEFAULT_MAX_HELD_BYTES):
+    """Writes every OutputPlan of plans from one pass over input_stream.
+
+    The union of the frames the plans need is read once, in file order, and
+    each frame is written to every plan that's ready for it. A frame is
+    held only while some plan still needs it. Plans that use frames in file
+    order, such as trims of the source, hold almost nothing. A plan that
+    goes back, such as a reversal, holds frames until it reaches them. If
+    more than max_held_bytes are held, the oldest frames are dropped and
+    read again when needed. Returns a FanOutStats.
+
+    Outputs aren't closed. If workers > 1, reads are issued from that many
+    threads."""
+    return _FanOut(input_stream, plans, max_held_bytes).run(workers)
@@ -0,0 +1,241 @@
+import array
+import re
+import struct
+
+
+# ISO/IEC 14496-2 (MPEG-4 Part 2 Visual)
+
+
+TYPE_UNKNOWN = 0
+TYPE_I = 1
+TYPE_P = 2
+TYPE_B = 3
+TYPE_S = 4
+# not-coded VOPs and the 1-byte placeholders that follow packed frames
+TYPE_N = 5
+
+# set alongside the type of a frame that holds a packed B-VOP after its first
+# VOP, as written by DivX 5 and XviD in packed bitstream mode
+FLAG_PACKED = 0x80
+TYPE_MASK = 0x7F
+
+TYPE_NAMES = { TYPE_UNKNOWN: "?", TYPE_I: "I", TYPE_P: "P", TYPE_B: "B",
+    TYPE_S: "S", TYPE_N: "N" }
+
+# DIV3 and DIV4 are MS-MPEG4v3, which has no VOP start codes
+MPEG4_CODECS = frozenset((b"XVID", b"DIVX", b"DX50", b"FMP4", b"MP4V",
+    b"M4S2", b"3IV2", b"DIV5"))
+
+# enough for the VOP header, including start code, time base and vop_coded
+DEFAULT_HEAD_SIZE = 32
+# frames that begin with VOS/VO/VOL headers need a longer look
+HEADER_HEAD_SIZE = 512
+# frames at most this size with no VOP are placeholders
+_PLACEHOLDER_MAX_SIZE = 8
+
+_VOP_START = b"\x00\x00\x01\xb6"
+_USER_DATA_START = b"\x00\x00\x01\xb2"
+_VOL_START_PATTERN = re.compile(b"\x00\x00\x01[\x20-\x2f]")
+_DIVX_USER_DATA_PATTERN = re.compile(br"DivX(\d+)(?:b|Build)(\d+)(p?)")
+
+_VOL_ASPECT_EXTENDED = 15
+_VOL_SHAPE_GRAYSCALE = 3
+
+_VOP_CODING_TYPES = (TYPE_I, TYPE_P, TYPE_B, TYPE_S)
+
+_IF_KEYFRAME = 0x00000010
+
+_FILE_MAGIC = b"AVFT"
+_FILE_VERSION = 1
+_FILE_HEADER = struct.Struct("<4sHHI")
+
+
+def is_mpeg4_codec(fcc):
+    return fcc.upper() in MPEG4_CODECS
+
+
+def is_mpeg4_stream(video_stream):
+    # the stream header's handler is often generic, with the real codec in
+    # the bitmap info's compression
+    return (is_mpeg4_codec(video_stream.codec) or
+        is_mpeg4_codec(video_stream.compression))
+
+
+class _OutOfData(Exception):
+    pass
+
+
+class _BitReader(object):
+    def __init__(self, data, byte_pos=0):
+        self._value = int.from_bytes(data[byte_pos:], "big")
+        self._remain = (len(data) - byte_pos) * 8
+
+    def read(self, bit_count):
+        if bit_count > self._remain:
+            raise _OutOfData()
+        self._remain -= bit_count
+        return (self._value >> self._remain) & ((1 << bit_count) - 1)
+
+
+class VolInfo(object):
+    """The parts of the video object layer header needed to parse VOPs."""
+    def __init__(self):
+        self.time_increment_bits = None
+        self.packed = False
+
+    def update(self, data):
+        """Picks up VOL and DivX user data headers found in data."""
+        match = _VOL_START_PATTERN.search(data)
+        if match is not None:
+            try:
+                self.time_increment_bits = _parse_vol(data, match.end())
+            except _OutOfData:
+                pass
+
+        pos = data.find(_USER_DATA_START)
+        while pos >= 0:
+            match = _DIVX_USER_DATA_PATTERN.match(data, pos + 4)
+            if match is not None:
+                self.packed = match.group(3) == b"p"
+            pos = data.find(_USER_DATA_START, pos + 4)
+
+
+def _parse_vol(data, pos):
+    r = _BitReader(data, pos)
+    r.read(1)                           # random_accessible_vol
+    r.read(8)                           # video_object_type_indication
+    verid = 1
+    if r.read(1):                       # is_object_layer_identifier
+        verid = r.read(4)
+        r.read(3)                       # video_object_layer_priority
+    if r.read(4) == _VOL_ASPECT_EXTENDED:
+        r.read(16)                      # par_width, par_height
+    if r.read(1):                       # vol_control_parameters
+        r.read(3)                       # chroma_format, low_delay
+        if r.read(1):                   # vbv_parameters
+            r.read(79)
+    shape = r.read(2)
+    if shape == _VOL_SHAPE_GRAYSCALE and verid != 1:
+        r.read(4)                       # video_object_layer_shape_extension
+    r.read(1)                           # marker
+    resolution = r.read(16)             # vop_time_increment_resolution
+    return max(1, (resolution - 1).bit_length())
+
+
+def classify_vop(head, vol_info):
+    """Returns the type of the first VOP in head, the start of a frame's
+    payload, or TYPE_UNKNOWN if head doesn't contain enough of one."""
+    pos = head.find(_VOP_START)
+    if pos < 0:
+        return TYPE_UNKNOWN
+
+    r = _BitReader(head, pos + 4)
+    try:
+        vop_type = _VOP_CODING_TYPES[r.read(2)]
+        if vol_info.time_increment_bits is None:
+            return vop_type
+        while r.read(1):                # modulo_time_base
+            pass
+        r.read(1)                       # marker
+        r.read(vol_info.time_increment_bits)
+        r.read(1)                       # marker
+        if not r.read(1):               # vop_coded
+            return TYPE_N
+    except _OutOfData:
+        pass
+    return vop_type
+
+
+class FrameTypeTable(object):
+    """Per-frame types of a video stream, one byte each."""
+    def __init__(self, types=None):
+        if types is None:
+            types = array.array("B")
+        self.types = types
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, frame_num):
+        return self.types[frame_num] & TYPE_MASK
+
+    def is_packed(self, frame_num):
+        return bool(self.types[frame_num] & FLAG_PACKED)
+
+    def frames_of_type(self, frame_type):
+        return [ n for n, t in enumerate(self.types) if t & TYPE_MASK == frame_type ]
+
+    def summary(self):
+        return "".join(TYPE_NAMES[t & TYPE_MASK] for t in self.types)
+
+    def save(self, bytestream):
+        bytestream.write(_FILE_HEADER.pack(
+            _FILE_MAGIC, _FILE_VERSION, 0, len(self.types)))
+        bytestream.write(self.types.tobytes())
+
+    @classmethod
+    def load(cls, bytestream):
+        magic, version, _, count = _FILE_HEADER.unpack(
+            bytestream.read(_FILE_HEADER.size))
+        if magic != _FILE_MAGIC or version != _FILE_VERSION:
+            raise ValueError("Not a frame type table")
+        types = array.array("B")
+        types.frombytes(bytestream.read(count))
+        if len(types) != count:
+            raise ValueError("Frame type table truncated")
+        return cls(types)
+
+
+def classify_stream(video_stream, head_size=DEFAULT_HEAD_SIZE, workers=1):
+    """Classifies every frame of an InputVideoStream by reading only the
+    first head_size bytes of each. Streams in codecs other than MPEG-4 Part 2
+    get TYPE_I for keyframes and TYPE_UNKNOWN otherwise."""
+    owner = video_stream._owner
+    stream_num = video_stream.stream_num
+    frame_count = video_stream.frame_count
+
+    types = array.array("B", bytes(frame_count))
+    table = FrameTypeTable(types)
+
+    if not is_mpeg4_stream(video_stream):
+        for frame_num, flags, _, _ in owner.read_frame_heads(
+                stream_num, range(frame_count), 0, workers):
+            if flags & _IF_KEYFRAME:
+                types[frame_num] = TYPE_I
+        return table
+
+    vol_info = VolInfo()
+    if video_stream.codec_data is not None:
+        vol_info.update(video_stream.codec_data)
+
+    # stream headers normally precede the first VOP of the first frame
+    if frame_count > 0:
+        for _, _, _, head in owner.read_frame_heads(
+                stream_num, [ 0 ], HEADER_HEAD_SIZE):
+            vol_info.update(head)
+
+    # frames whose VOP didn't fit in head_size, usually keyframes repeating
+    # the stream headers
+    retry = [ ]
+    for frame_num, flags, size, head in owner.read_frame_heads(
+            stream_num, range(frame_count), head_size, workers):
+        t = classify_vop(head, vol_info)
+        if t == TYPE_UNKNOWN:
+            if size <= _PLACEHOLDER_MAX_SIZE:
+                t = TYPE_N
+            elif size > len(head):
+                retry.append(frame_num)
+        types[frame_num] = t
+
+    for frame_num, flags, size, head in owner.read_frame_heads(
+            stream_num, retry, HEADER_HEAD_SIZE, workers):
+        types[frame_num] = classify_vop(head, vol_info)
+
+    if vol_info.packed:
+        # the B-VOP packed into a frame displaces the next frame, which is
+        # then left as a placeholder
+        for n in range(frame_count - 1):
+            if types[n + 1] == TYPE_N and types[n] in (TYPE_I, TYPE_P, TYPE_S):
+                types[n] |= FLAG_PACKED
+
+    return table
@@ -0,0 +1,147 @@
+import concurrent.futures
+import threading
+import time
+
+
+DEFAULT_WINDOW = 64
+
+
+class ReorderStats(object):
+    def __init__(self):
+        self.frames_written = 0
+        self.max_occupancy = 0
+        self._occupancy_total = 0
+        self._occupancy_samples = 0
+        # seconds producers spent blocked on a full window, and the writer
+        # spent waiting for the next frame
+        self.producer_wait = 0.0
+        self.writer_wait = 0.0
+
+    def sample(self, occupancy):
+        self.max_occupancy = max(self.max_occupancy, occupancy)
+        self._occupancy_total += occupancy
+        self._occupancy_samples += 1
+
+    def mean_occupancy(self):
+        if self._occupancy_samples > 0:
+            return self._occupancy_total / self._occupancy_samples
+        return 0.0
+
+    def __repr__(self):
+        return ("ReorderStats(frames_written={0}, max_occupancy={1}, "
+            "mean_occupancy={2:.2f}, producer_wait={3:.3f}, "
+            "writer_wait={4:.3f})").format(self.frames_written,
+            self.max_occupancy, self.mean_occupancy(), self.producer_wait,
+            self.writer_wait)
+
+
+class OrderedWriter(object):
+    """Writes frames to an OutputVideoStream in sequence order from a
+    dedicated thread, while frames are submitted in any order.
+
+    Each frame is submitted with its sequence number, counting from
+    first_seq. Submissions for sequence numbers at least window ahead of the
+    next frame to be written block until the writer catches up, which
+    bounds the number of frames held for reordering. Since the next frame
+    is always inside the window, a producer of it is never blocked. A frame
+    may be an AviFrame, None to skip that sequence number, or a Future
+    resolving to either.
+    """
+    def __init__(self, output_stream, window=DEFAULT_WINDOW, first_seq=0):
+        self._stream = output_stream
+        self._window = window
+        self._next = first_seq
+        self._end = None
+        self._pending = { }
+        self._error = None
+        self._cond = threading.Condition()
+
+        self.stats = ReorderStats()
+
+        self._thread = threading.Thread(target=self._run,
+            name="OrderedWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, seq, frame):
+        with self._cond:
+            if seq < self._next or seq in self._pending:
+                raise ValueError("Sequence number {0} already submitted".format(seq))
+            if self._end is not None:
+                raise ValueError("Writer is closed")
+
+            self._wait_for_room(seq)
+
+            self._pending[seq] = frame
+            self.stats.sample(len(self._pending))
+            self._cond.notify_all()
+
+    def map(self, executor, func, items):
+        """Submits func(item) to executor for each of items, in sequence
+        order from the next unsubmitted number, and queues the futures.
+        Submission to the executor is held back by the window, so items can
+        be a long or lazy iterable."""
+        with self._cond:
+            seq = max([ self._next ] + [ s + 1 for s in self._pending ])
+        for item in items:
+            self._wait_for_room(seq)
+            self.submit(seq, executor.submit(func, item))
+            seq += 1
+
+    def close(self):
+        """Waits for every frame up to the highest sequence number submitted
+        to be written, then stops the writer thread. Raises any exception
+        from writing or from a submitted future."""
+        with self._cond:
+            self._end = max([ self._next ] + [ s + 1 for s in self._pending ])
+            self._cond.notify_all()
+        self._thread.join()
+        with self._cond:
+            self._raise_error()
+
+    def _wait_for_room(self, seq):
+        # the condition's lock is re-entrant, so this is also called by submit
+        with self._cond:
+            started = None
+            while seq >= self._next + self._window and self._error is None:
+                if started is None:
+                    started = time.perf_counter()
+                self._cond.wait()
+            if started is not None:
+                self.stats.producer_wait += time.perf_counter() - started
+            self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    started = time.perf_counter()
+                    while self._next not in self._pending:
+                        if self._end is not None:
+                            if self._next >= self._end:
+                                return
+                            raise ValueError("Sequence number {0} was never "
+                                "submitted".format(self._next))
+                        self._cond.wait()
+                    self.stats.writer_wait += time.perf_counter() - started
+                    frame = self._pending.pop(self._next)
+
+                if isinstance(frame, concurrent.futures.Future):
+                    started = time.perf_counter()
+                    frame = frame.result()
+                    self.stats.writer_wait += time.perf_counter() - started
+
+                if frame is not None:
+                    self._stream.write_frame(frame)
+                    self.stats.frames_written += 1
+
+                with self._cond:
+                    self._next += 1
+                    self._cond.notify_all()
+        except BaseException as e:
+            with self._cond:
+                self._error = e
+                self._cond.notify_all()
@@ -0,0 +1,92 @@
+import numpy as np
+
+
+# Compression values of uncompressed DIB streams. BI_RGB is zero.
+RAW_COMPRESSIONS = frozenset((b"\x00\x00\x00\x00", b"DIB ", b"RGB ", b"RAW "))
+
+# bit depth -> (dtype, channels). 8-bit frames are palette indices, 16-bit
+# frames are packed RGB555 words, and 24 and 32-bit frames are B, G, R(, A)
+# bytes.
+_PIXEL_LAYOUTS = {
+    8:  (np.dtype(np.uint8), None),
+    16: (np.dtype("<u2"), None),
+    24: (np.dtype(np.uint8), 3),
+    32: (np.dtype(np.uint8), 4)
+}
+
+
+def is_raw(video_stream):
+    return (video_stream.compression in RAW_COMPRESSIONS and
+        video_stream.bit_depth in _PIXEL_LAYOUTS)
+
+
+def row_stride(width, bit_depth):
+    """Bytes per row of a DIB, which pads rows to a multiple of 4 bytes."""
+    return ((width * bit_depth + 31) // 32) * 4
+
+
+def _layout(video_stream):
+    if not is_raw(video_stream):
+        raise ValueError("Stream isn't uncompressed 8/16/24/32-bit video: "
+            "compression {0!r}, {1} bits".format(
+                video_stream.compression, video_stream.bit_depth))
+
+    dtype, channels = _PIXEL_LAYOUTS[video_stream.bit_depth]
+    width = video_stream.width
+    rows = abs(video_stream.height)
+    stride = row_stride(width, video_stream.bit_depth)
+
+    if channels is None:
+        shape = (rows, width)
+        strides = (stride, dtype.itemsize)
+    else:
+        shape = (rows, width, channels)
+        strides = (stride, channels, 1)
+
+    # a positive height means the rows are stored bottom to top
+    return shape, strides, dtype, stride, video_stream.height > 0
+
+
+def frame_array(video_stream, data):
+    """Returns an array viewing the frame data without copying it, with rows
+    top to bottom and any row padding skipped. The array is read-only if
+    data is bytes. Shape is (height, width) for 8 and 16-bit streams and
+    (height, width, channels) for 24 and 32-bit streams."""
+    shape, strides, dtype, stride, bottom_up = _layout(video_stream)
+    needed = stride * shape[0]
+    if len(data) < needed:
+        raise ValueError("Expected at least {0} bytes of frame data, got {1}".format(
+            needed, len(data)))
+
+    array = np.ndarray(shape, dtype, buffer=data, strides=strides)
+    if bottom_up:
+        array = array[::-1]
+    return array
+
+
+def frame_parts(video_stream, array):
+    """Returns a list of buffers that together make up the frame data for
+    array, in the stream's row order and with row padding. When array views
+    a buffer already laid out that way, the list is just that buffer."""
+    shape, _, dtype, stride, bottom_up = _layout(video_stream)
+    array = np.asarray(array)
+    if array.shape != shape:
+        raise ValueError("Expected array of shape {0}, got {1}".format(
+            shape, array.shape))
+    if array.dtype != dtype:
+        array = array.astype(dtype)
+
+    if bottom_up:
+        array = array[::-1]
+
+    padding = stride - array[0].nbytes
+    if padding == 0 and array.flags.c_contiguous:
+        return [ memoryview(array).cast("B") ]
+
+    pad = bytes(padding)
+    parts = [ ]
+    for row in array:
+        parts.append(np.ascontiguousarray(row).data.cast("B"))
+        if padding:
+            parts.append(pad)
+    return parts
@@ -0,0 +1,299 @@
+import Avi
+
+import collections
+import os
+
+
+DEFAULT_BLOCK_SIZE = 1 << 22
+# the number of following headers a chunk header must lead to, one after
+# the other, to be believed
+DEFAULT_CHAIN_LENGTH = 2
+
+# two-character suffixes of stream chunk ids, and the other fourccs that can
+# start a chunk inside movi. These are what resynchronization searches for
+_STREAM_CHUNK_TYPES = (b"dc", b"db", b"wb", b"pc", b"tx")
+_RESYNC_TOKENS = _STREAM_CHUNK_TYPES + (b"LIST", b"idx1")
+_MAX_TOKEN_LENGTH = max(len(token) for token in _RESYNC_TOKENS)
+
+_HEADER_SIZE = Avi._CHUNK_HEADER.size
+_LIST_HEADER_SIZE = _HEADER_SIZE + 4
+_INDEX_ENTRY_SIZE = Avi.OldIndexEntry.codec.size
+
+# kinds of header
+_STREAM_CHUNK = "chunk"
+_LIST = "list"
+_SKIPPED = "skipped"
+_INDEX = "index"
+
+_Header = collections.namedtuple("_Header",
+    ("kind", "fcc", "pos", "size", "next"))
+
+
+RecoveredIndex = collections.namedtuple("RecoveredIndex",
+    ("stream_indices", "aux_index", "movi_length", "damage"))
+
+
+class DamageReport(object):
+    def __init__(self):
+        self.chunks_recovered = 0
+        # (start, end) file offsets of each region skipped while
+        # resynchronizing
+        self.damaged = [ ]
+        # file offset of a final chunk cut short by the end of the file
+        self.truncated_at = None
+        # where the movi list ends according to its header, and where the
+        # last chunk recovered from it ends
+        self.declared_end = None
+        self.recovered_end = None
+
+    def bytes_skipped(self):
+        return sum(end - start for start, end in self.damaged)
+
+    def is_clean(self):
+        return (not self.damaged and self.truncated_at is None and
+            self.recovered_end == self.declared_end)
+
+    def __repr__(self):
+        return ("DamageReport(chunks_recovered={0}, damaged_regions={1}, "
+            "bytes_skipped={2}, truncated_at={3}, declared_end={4}, "
+            "recovered_end={5})").format(self.chunks_recovered,
+            len(self.damaged), self.bytes_skipped(), self.truncated_at,
+            self.declared_end, self.recovered_end)
+
+
+class _Window(object):
+    """A buffer over a forward-moving region of a file, read in large
+    blocks."""
+    def __init__(self, bytestream, start, end, block_size):
+        self._file = bytestream
+        self._base = start
+        self._buf = b""
+        self._end = end
+        self._block_size = block_size
+        # the next occurrence of each token found by find_any, and where its
+        # search stopped
+        self._hits = { }
+        self._searched = { }
+
+    def get(self, pos, length):
+        length = min(length, self._end - pos)
+        buf_end = self._base + len(self._buf)
+        if pos < self._base or pos > buf_end + self._block_size:
+            # far outside the window, such as the header after a large chunk
+            # while checking a chain: read it on its own
+            self._file.seek(pos, os.SEEK_SET)
+            return self._file.read(length)
+        if pos + length > buf_end:
+            self._extend(pos + length)
+        offset = pos - self._base
+        return self._buf[offset:offset + length]
+
+    def find_any(self, tokens, start):
+        """Returns (file offset, token) of the earliest occurrence of any of
+        tokens at or after start, or (-1, None). Each token is searched for
+        from where its last search stopped, so occurrences passed over by a
+        call with a later start aren't found again."""
+        while True:
+            buf_end = self._base + len(self._buf)
+            best = (-1, None)
+            for token in tokens:
+                at = self._hits.get(token, -1)
+                if at < start:
+                    # carry on from where the last search for it stopped
+                    offset = max(start, self._searched.get(token, start)) - self._base
+                    found = self._buf.find(token, max(0, offset))
+                    if found < 0:
+                        at = -1
+                        self._searched[token] = buf_end - len(token) + 1
+                    else:
+                        at = self._base + found
+                    self._hits[token] = at
+                if at >= 0 and (best[0] < 0 or at < best[0]):
+                    best = (at, token)
+            if best[0] >= 0 or buf_end >= self._end:
+                return best
+            # keep enough of the tail for a token spanning the next block
+            self.discard_before(max(start, buf_end - _MAX_TOKEN_LENGTH + 1))
+            self._extend(buf_end + self._block_size)
+
+    def discard_before(self, pos):
+        offset = pos - self._base
+        if offset >= len(self._buf):
+            self._buf = b""
+            self._base = pos
+        elif offset > self._block_size:
+            self._buf = self._buf[offset:]
+            self._base = pos
+
+    def _extend(self, to):
+        buf_end = self._base + len(self._buf)
+        to = min(max(to, buf_end + self._block_size), self._end)
+        self._file.seek(buf_end, os.SEEK_SET)
+        self._buf += self._file.read(to - buf_end)
+
+
+class _Scanner(object):
+    def __init__(self, bytestream, movi_offset, movi_length, stream_count,
+            block_size, chain_length):
+        bytestream.seek(0, os.SEEK_END)
+        self._file_size = bytestream.tell()
+
+        self._movi_offset = movi_offset
+        self._start = movi_offset + 4
+        declared_end = self._start + movi_length + (movi_length & 1)
+        # crashed captures often leave the movi size as zero, or as it was
+        # when last flushed, so fall back to scanning to the end of the file
+        if 0 < movi_length and declared_end <= self._file_size:
+            self._end = declared_end
+        else:
+            self._end = self._file_size
+
+        self._stream_count = stream_count
+        self._chain_length = max(1, chain_length)
+        self._window = _Window(bytestream, self._start, self._file_size, block_size)
+
+        self._stream_indices = collections.defaultdict(list)
+        self._aux_index = [ ]
+        self._report = DamageReport()
+        self._report.declared_end = declared_end
+
+    def scan(self):
+        pos = self._start
+        recovered_end = pos
+        while pos < self._end:
+            self._window.discard_before(pos)
+            header = self._header(pos)
+            if header is not None and header.kind == _INDEX:
+                break
+
+            if header is not None:
+                next_pos = self._chained_next(header)
+                if next_pos is not None:
+                    self._accept(header)
+                    pos = recovered_end = next_pos
+                    continue
+
+            # either this header is garbage, or its size doesn't lead to
+            # another header. Find the next header that chains
+            search_from = pos + 1
+            if header is not None:
+                search_from = pos + (_LIST_HEADER_SIZE if header.kind == _LIST
+                    else _HEADER_SIZE)
+            found = self._resync(search_from)
+            resync_pos = self._end if found is None else found
+
+            if header is not None and header.next <= resync_pos:
+                # the header is sound, and the damage is somewhere after it
+                self._accept(header)
+                pos = recovered_end = header.next
+                continue
+
+            if found is None and self._is_truncated(pos):
+                self._report.truncated_at = pos
+            self._report.damaged.append((pos, resync_pos))
+            pos = resync_pos
+
+        self._report.recovered_end = recovered_end
+        return RecoveredIndex(self._stream_indices, self._aux_index,
+            recovered_end - self._start, self._report)
+
+    def _accept(self, header):
+        if header.kind != _STREAM_CHUNK:
+            return
+        pointer = Avi._IndexPointer(header.fcc, 0,
+            header.pos - self._movi_offset, header.size)
+        stream_num, _ = Avi._unpack_frame_fcc(header.fcc)
+        if stream_num is not None:
+            self._stream_indices[stream_num].append(pointer)
+        else:
+            self._aux_index.append(pointer)
+        self._report.chunks_recovered += 1
+
+    def _chained_next(self, header):
+        if self._chains(header.next, self._chain_length):
+            return header.next
+        # some writers don't pad odd-sized chunks
+        if header.size & 1 and header.kind != _LIST and \
+                self._chains(header.next - 1, self._chain_length):
+            return header.next - 1
+        return None
+
+    def _chains(self, pos, depth):
+        while depth > 0:
+            if pos == self._end:
+                return True
+            header = self._header(pos)
+            if header is None:
+                return False
+            if header.kind == _INDEX:
+                return True
+            pos = header.next
+            depth -= 1
+        return True
+
+    def _resync(self, start):
+        search = start
+        while True:
+            at, token = self._window.find_any(_RESYNC_TOKENS, search)
+            if at < 0:
+                return None
+            search = at + 1
+            if token in _STREAM_CHUNK_TYPES:
+                # the suffix follows the two-digit stream number
+                at -= 2
+            if at >= start and self._chains(at, self._chain_length + 1):
+                return at
+
+    def _header(self, pos):
+        data = self._window.get(pos, _LIST_HEADER_SIZE)
+        if len(data) < _HEADER_SIZE:
+            return None
+        fcc, size = Avi._CHUNK_HEADER.unpack_from(data)
+        content_end = pos + _HEADER_SIZE + size
+        next_pos = content_end + (size & 1)
+
+        if fcc[2:] in _STREAM_CHUNK_TYPES and fcc[:2].isdigit():
+            if int(fcc[:2]) >= self._stream_count or content_end > self._end:
+                return None
+            return _Header(_STREAM_CHUNK, fcc, pos, size, min(next_pos, self._end))
+
+        if fcc == b"LIST":
+            if data[_HEADER_SIZE:] != b"rec " or content_end > self._end:
+                return None
+            return _Header(_LIST, fcc, pos, size, pos + _LIST_HEADER_SIZE)
+
+        if fcc == b"JUNK" or (fcc[:2] == b"ix" and fcc[2:].isdigit()):
+            if content_end > self._end:
+                return None
+            return _Header(_SKIPPED, fcc, pos, size, min(next_pos, self._end))
+
+        if fcc == b"idx1":
+            if size % _INDEX_ENTRY_SIZE != 0 or content_end > self._file_size:
+                return None
+            return _Header(_INDEX, fcc, pos, size, next_pos)
+
+        return None
+
+    def _is_truncated(self, pos):
+        # whether pos has a stream chunk id, but a size that runs past the end
+        data = self._window.get(pos, _HEADER_SIZE)
+        if len(data) < _HEADER_SIZE:
+            return len(data) > 0
+        fcc, size = Avi._CHUNK_HEADER.unpack_from(data)
+        return (fcc[2:] in _STREAM_CHUNK_TYPES and fcc[:2].isdigit() and
+            pos + _HEADER_SIZE + size > self._end)
+
+
+def scan_movi(bytestream, movi_offset, movi_length, stream_count,
+        block_size=DEFAULT_BLOCK_SIZE, chain_length=DEFAULT_CHAIN_LENGTH):
+    """Builds a best-effort index of the movi list at movi_offset, which
+    should point at its 'movi' fourcc, without trusting chunk sizes.
+
+    Chunks are followed by their sizes as long as each header leads to
+    chain_length more plausible headers. Otherwise, the region is searched
+    for the next stream chunk, LIST or idx1 header that does, and skipped
+    up to it. The file is read forward once, in blocks of block_size.
+    Returns a RecoveredIndex, whose movi_length ends at the last chunk
+    recovered and whose damage is a DamageReport."""
+    return _Scanner(bytestream, movi_offset, movi_length, stream_count,
+        block_size, chain_length).scan()
@@ -0,0 +1,279 @@
+import Avi
+import Timecode
+
+import bisect
+import collections
+import itertools
+
+
+DEFAULT_MAX_OPEN = 16
+
+
+class _SegmentedVideoStream(Avi.InputVideoStream):
+    @property
+    def frame_count(self):
+        return self._owner._stream_frame_count(self.stream_num)
+
+    @frame_count.setter
+    def frame_count(self, value):
+        # the count comes from the segments. VideoStream.__init__ sets it
+        pass
+
+
+class _SegmentTemplate(object):
+    # stands in for a file name template when extracting from one segment,
+    # giving the template frame numbers counted across all segments
+    def __init__(self, name_template, first_frame, frame_rate):
+        self._template = name_template
+        self._first = first_frame
+        self._frame_rate = frame_rate
+
+    def format(self, frame_num, frame_type, seconds, timecode):
+        frame_num += self._first
+        return self._template.format(
+            frame_num=frame_num,
+            frame_type=frame_type,
+            seconds=frame_num / self._frame_rate,
+            timecode=Timecode.format_timecode(
+                frame_num, self._frame_rate, separator="-"))
+
+
+class SegmentedInput(object):
+    """Presents a sequence of compatible AVI files as one input, numbering
+    frames across all of them.
+
+    Only the headers of each segment are read on open, and a table of each
+    segment's first frame number is built from the frame counts they
+    declare, so that finding the segment of a frame is a binary search. A
+    segment's index is loaded when a frame of it is first read. If its
+    real frame count differs from the declared one, the table is corrected
+    then, and frames of later segments are renumbered. A frame number past
+    the end of the table loads the remaining indices before it's taken to
+    be out of range. Segments that declare no frames have their index
+    loaded on open.
+
+    As on a lazily opened AviInput, a stream's frame_count loads every
+    index, while its declared_frame_count is the total the segments declare.
+
+    At most max_open files are kept open at once; the least recently used
+    is closed and reopened when needed again.
+    """
+    def __init__(self, paths, max_open=DEFAULT_MAX_OPEN, debug=None):
+        self._paths = list(paths)
+        if not self._paths:
+            raise ValueError("No segments")
+
+        self._max_open = max(1, max_open)
+        self._debug = debug
+
+        self._segments = [ ]
+        self._handles = collections.OrderedDict()
+        self._last_frame = None
+
+        for segment_num in range(len(self._paths)):
+            self._open_segment(segment_num)
+
+        first = self._segments[0]
+        self.max_bytes_per_sec = first.max_bytes_per_sec
+        self.video_streams = [ ]
+        # stream_num -> frame count of each segment, and the first frame
+        # number of each segment plus the frame number after the last one
+        self._counts = { }
+        self._starts = { }
+        # incremented whenever the table changes
+        self._table_version = 0
+        for basis in first.video_streams:
+            vs = _SegmentedVideoStream(self)
+            vs.set_from(basis)
+            vs.stream_num = basis.stream_num
+            self.video_streams.append(vs)
+
+            counts = [ ]
+            for avi in self._segments:
+                segment_vs = avi._video_stream(vs.stream_num)
+                vs.declared_frame_count += segment_vs.declared_frame_count
+                if avi._stream_indices is not None:
+                    counts.append(segment_vs.frame_count)
+                else:
+                    counts.append(segment_vs.declared_frame_count)
+            self._counts[vs.stream_num] = counts
+            self._update_starts(vs.stream_num)
+
+    def get_frame(self, frame_num=None, seconds=None, timecode=None):
+        return self.video_streams[0].get_frame(frame_num, seconds, timecode)
+
+    def get_stream_frame(self, stream_num, frame_num, writable=False):
+        if frame_num < 0:
+            return None
+
+        last = self._last_frame
+        if not writable and last is not None and last[0] == stream_num and \
+                last[1].frame_num == frame_num:
+            return last[1]
+
+        location = self.locate(stream_num, frame_num)
+        if location is None:
+            return None
+        segment_num, local_num = location
+
+        avi = self._open(segment_num)
+        frame = avi.get_stream_frame(stream_num, local_num, writable)
+        if frame is None:
+            return None
+
+        frame = frame._replace(frame_num=frame_num)
+        if not writable:
+            self._last_frame = (stream_num, frame)
+        return frame
+
+    def get_stream_keyframes(self, stream_num):
+        self._load_all_indices()
+
+        keyframes = [ ]
+        for segment_num in range(len(self._segments)):
+            avi = self._open(segment_num)
+            first = self._starts[stream_num][segment_num]
+            keyframes.extend(first + n for n in avi.get_stream_keyframes(stream_num))
+        return keyframes
+
+    def read_stream_frames(self, stream_num, frame_nums, workers=1):
+        for segment_num, first, local_nums in self._split(stream_num, frame_nums):
+            avi = self._open(segment_num)
+            for frame in avi.read_stream_frames(stream_num, local_nums, workers):
+                yield frame._replace(frame_num=frame.frame_num + first)
+
+    def read_frame_heads(self, stream_num, frame_nums, size, workers=1):
+        for segment_num, first, local_nums in self._split(stream_num, frame_nums):
+            avi = self._open(segment_num)
+            for frame_num, flags, frame_size, head in avi.read_frame_heads(
+                    stream_num, local_nums, size, workers):
+                yield (frame_num + first, flags, frame_size, head)
+
+    def extract_stream_frames(self, stream_num, frame_nums, name_template,
+            workers=4, max_in_flight=Avi._EXTRACT_IN_FLIGHT):
+        frame_rate = self._video_stream(stream_num).frame_rate
+        count = 0
+        for segment_num, first, local_nums in self._split(stream_num, frame_nums):
+            avi = self._open(segment_num)
+            count += avi.extract_stream_frames(stream_num, local_nums,
+                _SegmentTemplate(name_template, first, frame_rate),
+                workers, max_in_flight)
+        return count
+
+    def locate(self, stream_num, frame_num):
+        """Returns (segment number, frame number within it) for a frame, or
+        None if it's past the end of the last segment. Loads the index of
+        the segment found."""
+        if frame_num < 0:
+            return None
+        while True:
+            starts = self._starts[stream_num]
+            if frame_num >= starts[-1]:
+                # the declared counts may fall short, so only give up once
+                # the real counts are known
+                if not self._load_all_indices():
+                    return None
+                continue
+            segment_num = bisect.bisect_right(starts, frame_num) - 1
+            # loading the index can correct the table, so look again if so
+            if not self._load_index(segment_num):
+                return segment_num, frame_num - starts[segment_num]
+
+    def segment_count(self):
+        return len(self._paths)
+
+    def close(self):
+        for segment_num in list(self._handles):
+            self._close_handle(segment_num)
+
+    def _stream_frame_count(self, stream_num):
+        self._load_all_indices()
+        return self._starts[stream_num][-1]
+
+    def _video_stream(self, stream_num):
+        for vs in self.video_streams:
+            if vs.stream_num == stream_num:
+                return vs
+        raise IndexError("No video stream #{0}".format(stream_num))
+
+    def _split(self, stream_num, frame_nums):
+        # groups frame_nums by segment, in segment order, as
+        # (segment number, first frame number of segment, local numbers)
+        frame_nums = list(frame_nums)
+        while True:
+            # locating loads indices, which can renumber frames, so start
+            # again until a pass goes through without that happening
+            version = self._table_version
+            by_segment = collections.defaultdict(list)
+            for frame_num in frame_nums:
+                location = self.locate(stream_num, frame_num)
+                if location is None:
+                    raise IndexError("Frame {0} out of range".format(frame_num))
+                by_segment[location[0]].append(location[1])
+            if version == self._table_version:
+                break
+        for segment_num in sorted(by_segment):
+            yield (segment_num, self._starts[stream_num][segment_num],
+                by_segment[segment_num])
+
+    def _update_starts(self, stream_num):
+        self._starts[stream_num] = [ 0 ] + list(
+            itertools.accumulate(self._counts[stream_num]))
+
+    def _load_index(self, segment_num):
+        # loads the segment's index if it isn't already, and returns True if
+        # that changed any frame counts
+        avi = self._segments[segment_num]
+        if avi._stream_indices is not None:
+            return False
+
+        self._open(segment_num)._require_index()
+        changed = False
+        for vs in avi.video_streams:
+            counts = self._counts[vs.stream_num]
+            if counts[segment_num] != vs.frame_count:
+                counts[segment_num] = vs.frame_count
+                self._update_starts(vs.stream_num)
+                changed = True
+        if changed:
+            self._table_version += 1
+            self._last_frame = None
+        return changed
+
+    def _load_all_indices(self):
+        # returns True if that changed any frame counts
+        changed = False
+        for segment_num in range(len(self._segments)):
+            if self._load_index(segment_num):
+                changed = True
+        return changed
+
+    def _open_segment(self, segment_num):
+        handle = self._new_handle(segment_num)
+        avi = Avi.AviInput(handle, self._debug, lazy=True)
+        if self._segments:
+            Avi.check_compatible(self._segments[0], avi)
+        if any(vs.declared_frame_count == 0 for vs in avi.video_streams):
+            # nothing to go on, such as a capture that wasn't finalized
+            avi._require_index()
+        self._segments.append(avi)
+
+    def _open(self, segment_num):
+        avi = self._segments[segment_num]
+        if segment_num in self._handles:
+            self._handles.move_to_end(segment_num)
+        else:
+            avi._file = self._new_handle(segment_num)
+        return avi
+
+    def _new_handle(self, segment_num):
+        while len(self._handles) >= self._max_open:
+            self._close_handle(next(iter(self._handles)))
+        handle = open(self._paths[segment_num], "rb")
+        self._handles[segment_num] = handle
+        return handle
+
+    def _close_handle(self, segment_num):
+        self._handles.pop(segment_num).close()
+        if segment_num < len(self._segments):
+            self._segments[segment_num]._file = None
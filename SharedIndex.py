@@ -0,0 +1,195 @@
+import Avi
+
+from multiprocessing import shared_memory
+import mmap
+import os
+import pickle
+import struct
+
+try:
+    import _posixshmem
+except ImportError:
+    # Windows, which has no resource tracker
+    _posixshmem = None
+
+
+# Layout of an exported index:
+#   header    _HEADER: magic, version, metadata length, entries offset
+#   metadata  pickled dict of plain values and packed header records
+#   entries   OldIndexEntry rows, each stream's index contiguous
+
+_MAGIC = b"AVSI"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIII")
+_ENTRY = Avi.OldIndexEntry.codec
+_ALIGN = 16
+
+
+class _PackedIndex(object):
+    """A read-only sequence of index pointers unpacked on access from a
+    buffer of OldIndexEntry rows."""
+    def __init__(self, buf):
+        self._buf = buf
+
+    def __len__(self):
+        return len(self._buf) // _ENTRY.size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self[j] for j in range(*i.indices(len(self))) ]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Index entry {0} out of range".format(i))
+        return Avi._IndexPointer._make(_ENTRY.unpack_from(self._buf, i * _ENTRY.size))
+
+    def __iter__(self):
+        for entry in _ENTRY.iter_unpack(self._buf):
+            yield Avi._IndexPointer._make(entry)
+
+
+def _build_image(avi):
+    avi._require_index()
+    tracks = [ ]
+    for stream_num, index in sorted(avi._stream_indices.items()):
+        tracks.append((stream_num, index))
+    tracks.append((None, avi._aux_index or [ ]))
+
+    layout = [ ]
+    entry_pos = 0
+    for stream_num, index in tracks:
+        layout.append((stream_num, entry_pos, len(index)))
+        entry_pos += len(index)
+
+    meta = pickle.dumps({
+        "file_header": avi.file_header.pack(),
+        "streams": [ (info.header.pack(),
+            info.bitmap_info.pack() if info.bitmap_info is not None else None,
+            info.codec_data, info.name) for info in avi._stream_data ],
+        "movi_offset": avi._movi_offset,
+        "movi_length": avi._movi_length,
+        "layout": layout
+    })
+
+    entries_offset = _HEADER.size + len(meta)
+    entries_offset += -entries_offset % _ALIGN
+
+    image = bytearray(entries_offset + entry_pos * _ENTRY.size)
+    _HEADER.pack_into(image, 0, _MAGIC, _VERSION, len(meta), entries_offset)
+    image[_HEADER.size:_HEADER.size + len(meta)] = meta
+    pos = entries_offset
+    for _, index in tracks:
+        packed = Avi.OldIndexEntry.pack_array(index)
+        image[pos:pos + len(packed)] = packed
+        pos += len(packed)
+    return image
+
+
+def _attach_image(bytestream, buf, debug):
+    buf = memoryview(buf).toreadonly()
+    magic, version, meta_length, entries_offset = _HEADER.unpack_from(buf)
+    if magic != _MAGIC or version != _VERSION:
+        raise Avi.FormatError("Not an exported AVI index")
+    meta = pickle.loads(buf[_HEADER.size:_HEADER.size + meta_length])
+
+    stream_data = [ ]
+    for header, bitmap_info, codec_data, name in meta["streams"]:
+        if bitmap_info is not None:
+            bitmap_info = Avi.BitmapInfoHeader.unpack_from(bitmap_info)
+        stream_data.append(Avi.StreamInfo(Avi.StreamHeader.unpack_from(header),
+            bitmap_info, codec_data, name))
+
+    stream_indices = { }
+    aux_index = None
+    for stream_num, start, count in meta["layout"]:
+        pos = entries_offset + start * _ENTRY.size
+        index = _PackedIndex(buf[pos:pos + count * _ENTRY.size])
+        if stream_num is None:
+            aux_index = index
+        else:
+            stream_indices[stream_num] = index
+
+    return Avi.AviInput._from_state(bytestream,
+        Avi.MainHeader.unpack_from(meta["file_header"]),
+        stream_data,
+        meta["movi_offset"],
+        meta["movi_length"],
+        stream_indices,
+        aux_index,
+        debug)
+
+
+class SharedIndex(object):
+    """Exports the headers and stream indices of a parsed AviInput to a
+    block of shared memory, which other processes can attach to by name
+    instead of parsing the file again. The exporting process should keep
+    this object alive while workers use it, and call unlink() when done."""
+    def __init__(self, avi_input, name=None):
+        image = _build_image(avi_input)
+        self._shm = shared_memory.SharedMemory(name, create=True, size=len(image))
+        self._shm.buf[:len(image)] = image
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def close(self):
+        self._shm.close()
+
+    def unlink(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+def attach(bytestream, name, debug=None):
+    """Returns an AviInput for bytestream using the index exported under
+    name, without parsing. The index is read in place from shared memory, so
+    each attached process adds no copy of it. Call close() on the AviInput
+    when done with it to release the shared memory."""
+    block, buf = _open_block(name)
+    avi = _attach_image(bytestream, buf, debug)
+    # the index views the block, which must outlive them
+    avi._shared_memory = block
+    return avi
+
+
+def _open_block(name):
+    # returns the attached block, with a close() method, and its buffer
+    try:
+        shm = shared_memory.SharedMemory(name, track=False)
+        return shm, shm.buf
+    except TypeError:
+        pass
+    if _posixshmem is None:
+        shm = shared_memory.SharedMemory(name)
+        return shm, shm.buf
+
+    # before Python 3.13, SharedMemory registers a block it attaches to with
+    # the resource tracker, which unlinks it when the attaching process
+    # exits. Worker processes share the creator's tracker whichever way they
+    # are started, so unregistering afterwards would drop the creator's own
+    # registration. Map the block without registering instead
+    fd = _posixshmem.shm_open("/" + name.lstrip("/"), os.O_RDONLY)
+    try:
+        mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+    return mapped, mapped
+
+
+def save(avi_input, path):
+    """Exports the headers and stream indices of avi_input to a file, which
+    attach_file can map instead of shared memory."""
+    with open(path, "wb") as out:
+        out.write(_build_image(avi_input))
+
+
+def attach_file(bytestream, path, debug=None):
+    """Returns an AviInput for bytestream using the index saved to path,
+    which is mapped rather than read. Call close() on the AviInput when done
+    with it to release the mapping."""
+    with open(path, "rb") as index_file:
+        mapped = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+    avi = _attach_image(bytestream, mapped, debug)
+    avi._shared_memory = mapped
+    return avi
@@ -103,3 +103,39 @@ def parse_timecode(t, fps, is_drop_frame=None):
         return -round(frame_n)
 
     return round(frame_n)
+
+
+def format_timecode(frame_n, fps, is_drop_frame=False, separator=":"):
+    """Formats a frame number as a timecode, the reverse of parse_timecode.
+
+    Keyword arguments:
+    frame_n -- The frame number to format.
+    fps -- The number of frames per second.
+    is_drop_frame -- Whether to format a drop-frame timecode. This will only
+        be considered if fps is close to 29.97, in which case the separator
+        between seconds and frames is ';'.
+    separator -- The separator to place between the other units.
+    """
+    fps = interpret_frame_rate(fps)
+
+    sign = ""
+    if frame_n < 0:
+        sign = "-"
+        frame_n = -frame_n
+
+    frame_sep = separator
+    if fps == EXACT_29_97 and is_drop_frame:
+        ten_minutes, rem = divmod(frame_n, 17982)
+        frame_n += 18 * ten_minutes + 2 * max(0, (rem - 2) // 1798)
+        frame_sep = ";"
+        seconds, frames = divmod(frame_n, 30)
+    else:
+        # as in parse_timecode, whole seconds are measured at the real rate
+        seconds = int(frame_n / fps)
+        frames = frame_n - round(seconds * fps)
+
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return "{0}{1:02d}{5}{2:02d}{5}{3:02d}{6}{4:02d}".format(
+        sign, hours, minutes, seconds, frames, separator, frame_sep)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+
+import contextlib
+import sys
+
+import Avi
+
+
+def concat_avi(in_streams, out_stream):
+    in_avis = [ Avi.AviInput(s) for s in in_streams ]
+
+    basis = in_avis[0]
+    for other in in_avis[1:]:
+        Avi.check_compatible(basis, other)
+
+    out_avi = Avi.AviOutput(out_stream)
+
+    in_v = basis.video_streams[0]
+    out_avi.frame_rate = in_v.frame_rate
+    out_avi.width = in_v.width
+    out_avi.height = in_v.height
+
+    for vs in basis.video_streams:
+        out_avi.new_stream(vs)
+
+    for in_avi in in_avis:
+        out_avi.append_movi(in_avi)
+
+    out_avi.close()
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: {0} INPUT... OUTPUT".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(2)
+
+    with contextlib.ExitStack() as stack:
+        in_streams = [ stack.enter_context(open(p, "rb")) for p in sys.argv[1:-1] ]
+        with open(sys.argv[-1], "wb") as out_stream:
+            concat_avi(in_streams, out_stream)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+
+import argparse
+
+import Avi
+
+
+def extract_avi(in_stream, name_template, keyframes_only=False, start=None,
+        end=None, workers=4, recover=False):
+    in_avi = Avi.AviInput(in_stream, recover=recover)
+    if in_avi.damage is not None and not in_avi.damage.is_clean():
+        print("Recovered from damage: {0!r}".format(in_avi.damage))
+    in_v = in_avi.video_streams[0]
+
+    if keyframes_only:
+        frame_nums = in_v.keyframes()
+    else:
+        frame_nums = range(in_v.frame_count)
+
+    if start is not None:
+        start = in_v.timecode_to_frame(start)
+        frame_nums = [ f for f in frame_nums if f >= start ]
+    if end is not None:
+        end = in_v.timecode_to_frame(end)
+        frame_nums = [ f for f in frame_nums if f < end ]
+
+    return in_v.extract_frames(name_template, frame_nums, workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Writes the frames of an AVI file to individual files.")
+    parser.add_argument("input")
+    parser.add_argument("name_template",
+        help="Output path, formatted with the fields {frame_num}, "
+             "{frame_type}, {seconds} and {timecode}, "
+             "e.g. 'out/frame{frame_num:06d}.bin'")
+    parser.add_argument("-k", "--keyframes", action="store_true",
+        help="Only extract keyframes")
+    parser.add_argument("-s", "--start", help="Timecode of the first frame")
+    parser.add_argument("-e", "--end", help="Timecode to stop before")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+        help="Number of writer threads")
+    parser.add_argument("-r", "--recover", action="store_true",
+        help="Rebuild a missing index by scanning past damaged chunks")
+    args = parser.parse_args()
+
+    with open(args.input, "rb") as in_stream:
+        count = extract_avi(in_stream, args.name_template, args.keyframes,
+            args.start, args.end, args.jobs, args.recover)
+    print("Extracted {0} frames".format(count))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,21 +4,22 @@
 import sys
 
 import Avi
+import Corruption
 
 
 def bounce(low, high, times):
-    for r in xrange(0, times):
-        for n in xrange(low, high):
+    for r in range(0, times):
+        for n in range(low, high):
             yield n
-        for n in xrange(high, low, -1):
+        for n in range(high, low, -1):
             yield n
 
 
 def benedict(src, dest):
-    for f in xrange(0, 6):
+    for f in range(0, 6):
         dest.write_frame(src.get_frame(f))
-    for r in xrange(0, 12):
-        for f in xrange(3, 6):
+    for r in range(0, 12):
+        for f in range(3, 6):
             dest.write_frame(src.get_frame(f))
 
 
@@ -34,9 +35,25 @@ def repeat_some(src, dest):
             dest.write_frame(frame)
 
 
+def corrupt_deltas(src, dest):
+    corruptor = Corruption.Corruptor([
+            Corruption.ByteFlip(0.0005),
+            Corruption.RunShuffle(64, 0.01)
+        ],
+        seed=1,
+        preserve_head=8,
+        preserve_start_codes=True)
+
+    frames = (src.get_frame(f) for f in range(0, src.frame_count))
+    for frame in Corruption.corrupt_frames(corruptor, frames,
+            should_corrupt=Corruption.is_delta_frame):
+        dest.write_frame(frame)
+
+
 def glitch_avi(in_stream, out_stream):
     in_avi = Avi.AviInput(in_stream, debug=True)
-    out_avi = Avi.AviOutput(out_stream, debug=True)
+    out_avi = Avi.AviOutput(out_stream, debug=True,
+        repeat_policy=Avi.REPEAT_REFERENCE)
 
     out_avi.max_bytes_per_sec = in_avi.max_bytes_per_sec
 
@@ -48,6 +65,7 @@ def glitch_avi(in_stream, out_stream):
     dest = out_avi.new_stream(src)
 
     # repeat_some(src, dest)
+    # corrupt_deltas(src, dest)
     benedict(src, dest)
 
     out_avi.close()
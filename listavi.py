@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+
+import sys
+
+import Avi
+
+
+def describe_avi(in_stream):
+    # only the headers are needed, so don't load the index
+    in_avi = Avi.AviInput(in_stream, lazy=True)
+    return [ (vs.stream_num, vs.width, abs(vs.height), vs.frame_rate,
+        vs.codec.decode(Avi._CP_WINDOWS, errors="replace"),
+        vs.declared_frame_count)
+        for vs in in_avi.video_streams ]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: {0} INPUT...".format(sys.argv[0]), file=sys.stderr)
+        sys.exit(2)
+
+    for path in sys.argv[1:]:
+        try:
+            with open(path, "rb") as in_stream:
+                streams = describe_avi(in_stream)
+        except (OSError, Avi.FormatError) as e:
+            print("{0}: {1}".format(path, e), file=sys.stderr)
+            continue
+
+        for stream_num, width, height, frame_rate, codec, frames in streams:
+            print("{0}\t#{1}\t{2}x{3}\t{4:g} fps\t{5}\t{6} frames".format(
+                path, stream_num, width, height, frame_rate, codec, frames))
+
+
+if __name__ == '__main__':
+    main()
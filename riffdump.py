@@ -2,16 +2,18 @@
 
 
 from Avi import MainHeader, StreamHeader, OldIndexEntry
-from ctypesutil import read_structure
 
-from ctypes import sizeof
 from pprint import pprint
 import os
 import struct
 import sys
 
 
-list_types = frozenset(("RIFF", "LIST"))
+list_types = frozenset((b"RIFF", b"LIST"))
+
+
+def read_record(stream, record_cls):
+    return record_cls.unpack_from(stream.read(record_cls.codec.size))
 
 
 def read_4cc(stream):
@@ -52,17 +54,17 @@ def dump(stream):
             if size & 1:
                 size += 1
 
-            if fourcc == "avih":
-                main_header = read_structure(stream, MainHeader)
-                pprint(main_header.__dict__)
-            elif fourcc == "strh":
-                stream_header = read_structure(stream, StreamHeader)
-                pprint(stream_header.__dict__)
-            elif fourcc == "idx1":
-                while size > 0:
-                    entry = read_structure(stream, OldIndexEntry)
-                    pprint(entry.__dict__)
-                    size -= sizeof(OldIndexEntry)
+            if fourcc == b"avih":
+                main_header = read_record(stream, MainHeader)
+                pprint(main_header._asdict())
+                stream.seek(size - MainHeader.codec.size, os.SEEK_CUR)
+            elif fourcc == b"strh":
+                stream_header = read_record(stream, StreamHeader)
+                pprint(stream_header._asdict())
+                stream.seek(size - StreamHeader.codec.size, os.SEEK_CUR)
+            elif fourcc == b"idx1":
+                for entry in OldIndexEntry.unpack_array(stream.read(size)):
+                    pprint(OldIndexEntry(*entry)._asdict())
             else:
                 stream.seek(size, os.SEEK_CUR)
 
@@ -0,0 +1,68 @@
+import struct
+
+
+class Record(object):
+    """Base for fixed-layout binary records. Subclasses are made with
+    define_record, which sets the field names and a precompiled struct.Struct
+    as the 'codec' class attribute."""
+    __slots__ = ()
+    codec = None
+    _defaults = ()
+
+    def __init__(self, *values):
+        if not values:
+            values = self._defaults
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    @classmethod
+    def unpack_from(cls, buffer, offset=0):
+        return cls(*cls.codec.unpack_from(buffer, offset))
+
+    @classmethod
+    def unpack_array(cls, buffer, count=None):
+        """Unpacks consecutive records from the start of buffer, returning
+        them as plain tuples, which avoids creating a record per entry."""
+        if count is None:
+            count = len(buffer) // cls.codec.size
+        return cls.codec.iter_unpack(memoryview(buffer)[:count * cls.codec.size])
+
+    @classmethod
+    def pack_array(cls, rows):
+        """Packs an iterable of value tuples into a single bytearray."""
+        rows = list(rows)
+        size = cls.codec.size
+        buf = bytearray(len(rows) * size)
+        pack_into = cls.codec.pack_into
+        for i, row in enumerate(rows):
+            pack_into(buf, i * size, *row)
+        return buf
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def pack(self):
+        return self.codec.pack(*self.values())
+
+    def pack_into(self, buffer, offset=0):
+        self.codec.pack_into(buffer, offset, *self.values())
+
+    def _asdict(self):
+        return dict(zip(self.__slots__, self.values()))
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__, ", ".join(
+            "{0}={1!r}".format(n, v) for n, v in zip(self.__slots__, self.values())))
+
+
+def define_record(name, fields, byte_order="<"):
+    """Creates a Record subclass from a sequence of (field_name, format)
+    pairs, where format is a struct format character with optional count."""
+    names = tuple(n for n, _ in fields)
+    formats = tuple(f for _, f in fields)
+    defaults = tuple(b"" if f.endswith("s") else 0 for f in formats)
+    return type(name, (Record,), {
+        "__slots__": names,
+        "codec": struct.Struct(byte_order + "".join(formats)),
+        "_defaults": defaults
+    })